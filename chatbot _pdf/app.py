@@ -1,36 +1,137 @@
 import os
+import sys
 import streamlit as st
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import OpenAIEmbeddings
 from langchain.chains import ConversationalRetrievalChain
-from langchain_community.chat_models import ChatOpenAI
-import tempfile
+import asyncio
 import json
 import random
+import time
 from datetime import datetime
 
+# Make the shared helpers in the repo-level utils/ package importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.chunker import StructuredChunker
+from utils.context_packer import PackedRetriever
+from utils.corpus_store import get_corpus_store
+from utils.hybrid_search import QUERY_VECTORS_KEY, HybridRetriever
+from utils.ingest_cache import IngestCache, embedding_settings, file_sha256, make_key
+from utils.jobs import DONE, FAILED, get_job_queue
+from utils.pipeline import stream_ingest
+from utils.reranker import RERANK_ENABLED, RerankingRetriever, get_reranker
+from utils.resources import get_chat_model, resource
+from utils.semantic_cache import SemanticCache
+from utils.streaming import TokenStream, iter_async
+from utils.studio_cache import StudioCache, documents_fingerprint
+from utils.summarizer import summarize_corpus
+from utils.tts import TTS_AVAILABLE, get_tts
+
 # --- Set your GPT API Key ---
 os.environ["OPENAI_API_KEY"] = ""
 
+# Chunking settings (also part of the ingestion cache key); structured chunks don't overlap
+CHUNK_TOKENS = 250
+CHUNK_OVERLAP = 0
+
+# Chat retrieval fuses this many vector and keyword hits per query, keeps the best
+# RETRIEVAL_CANDIDATES and packs them into a token budget
+HYBRID_FETCH_K = 20
+RETRIEVAL_CANDIDATES = 8
+CHAT_CONTEXT_TOKENS = 2500
+# With re-ranking (STUDY_BUDDY_RERANK=1) a cross-encoder picks the best few of more candidates
+RERANK_CANDIDATES = 20
+RERANK_TOP_N = 4
+# Ingestion and Studio outputs run as background jobs; the UI polls them this often
+JOB_POLL_SECONDS = 1.0
+# A generating Studio output publishes its text so far at most this often
+STUDIO_PROGRESS_SECONDS = 0.5
+
+def build_qa_chain(manager):
+    """Conversational retrieval chain over the session's hybrid (vector + BM25) index"""
+    if RERANK_ENABLED:
+        candidates = HybridRetriever(manager=manager, k=RERANK_CANDIDATES, fetch_k=HYBRID_FETCH_K)
+        candidates = RerankingRetriever(retriever=candidates, reranker=get_reranker(), top_n=RERANK_TOP_N)
+    else:
+        candidates = HybridRetriever(manager=manager, k=RETRIEVAL_CANDIDATES, fetch_k=HYBRID_FETCH_K)
+    retriever = PackedRetriever(
+        retriever=candidates,
+        max_tokens=CHAT_CONTEXT_TOKENS,
+        max_overlap=CHUNK_OVERLAP,
+    )
+    return ConversationalRetrievalChain.from_llm(
+        get_chat_model("gpt-4o", temperature=0, streaming=True),
+        retriever
+    )
+
+def stream_into(slot, run):
+    """Stream the tokens of ``run(callbacks)`` into the ``slot`` placeholder and return its result.
+
+    The stream is kept in the session so that a newer question cancels it.
+    """
+    stream = TokenStream(run)
+    st.session_state.active_stream = stream
+    slot.write_stream(iter(stream))
+    return stream.result
+
+@resource
+def get_answer_cache():
+    """Semantic answer cache shared by every session"""
+    return SemanticCache()
+
+def format_chat_history(chat_history):
+    """``(question, answer)`` pairs as the transcript the question generator prompt expects"""
+    return "".join(f"\nHuman: {question}\nAssistant: {answer}" for question, answer in chat_history)
+
+def answer_question(qa_chain, question, chat_history, embeddings, fingerprint=None, stream_to=None):
+    """Answer a chat question, serving repeats and near-paraphrases from the answer cache.
+
+    The question is first rewritten into a standalone question (as the chain
+    would do itself), which is what gets embedded and compared. Without a
+    document ``fingerprint`` the cache is skipped. With a ``stream_to``
+    placeholder the answer is written into it as it is generated.
+    """
+    standalone = question
+    if chat_history:
+        get_chat_history = qa_chain.get_chat_history or format_chat_history
+        standalone = qa_chain.question_generator.predict(question=question, chat_history=get_chat_history(chat_history))
+
+    def run_chain(vector=None):
+        inputs = {"question": standalone, "chat_history": []}
+        # The retriever reuses the question vector the cache lookup already paid for
+        config = {"metadata": {QUERY_VECTORS_KEY: {standalone: vector}}} if vector is not None else {}
+        if stream_to is None:
+            return qa_chain.invoke(inputs, config=config)["answer"]
+        return stream_into(stream_to, lambda callbacks: qa_chain.invoke(inputs, config={**config, "callbacks": callbacks})["answer"])
+
+    if fingerprint is None:
+        return run_chain()
+
+    cache = get_answer_cache()
+    vector = embeddings.embed_query(standalone)
+    answer = cache.lookup(fingerprint, vector, standalone, model=getattr(embeddings, "model", None))
+    if answer is None:
+        answer = run_chain(vector)
+        cache.store(fingerprint, vector, answer, standalone)
+    elif stream_to is not None:
+        stream_to.write(answer)
+    return answer
+
 # Studio Functions
-def generate_audio_overview(documents, language="English"):
-    """Generate audio overview of documents"""
-    if not documents:
-        return "No documents available for audio overview generation."
-    
-    # Extract text from documents
-    text_content = "\n".join([doc.page_content for doc in documents[:5]])  # Limit to first 5 pages
-    
-    llm = ChatOpenAI(model="gpt-4o", temperature=0.3)
-    
-    prompt = f"""
+# Token budget for the document content in Studio prompts (reports get more room)
+STUDIO_CONTEXT_TOKENS = 3000
+REPORT_CONTEXT_TOKENS = 4500
+
+def corpus_context(documents, max_tokens=STUDIO_CONTEXT_TOKENS):
+    """Map-reduce digest of all documents that fits in ``max_tokens`` tokens"""
+    return summarize_corpus(documents, get_chat_model("gpt-4o", temperature=0), max_tokens, max_overlap=CHUNK_OVERLAP)
+
+def audio_overview_prompt(text_content, language="English"):
+    """Prompt for an audio overview of the documents"""
+    return f"""
     Create a comprehensive audio overview of the following document content in {language}.
     The overview should be conversational and suitable for audio narration.
     
     Content:
-    {text_content[:2000]}...
+    {text_content}
     
     Please provide:
     1. A brief introduction to the topic
@@ -40,27 +141,14 @@ def generate_audio_overview(documents, language="English"):
     
     Format the response as a natural, flowing narrative suitable for audio presentation.
     """
-    
-    try:
-        response = llm.invoke(prompt)
-        return response.content
-    except Exception as e:
-        return f"Error generating audio overview: {str(e)}"
 
-def generate_video_overview(documents):
-    """Generate video overview script"""
-    if not documents:
-        return "No documents available for video overview generation."
-    
-    text_content = "\n".join([doc.page_content for doc in documents[:5]])
-    
-    llm = ChatOpenAI(model="gpt-4o", temperature=0.3)
-    
-    prompt = f"""
+def video_overview_prompt(text_content):
+    """Prompt for a video overview script"""
+    return f"""
     Create a video overview script for the following content. Include visual cues and timing suggestions.
     
     Content:
-    {text_content[:2000]}...
+    {text_content}
     
     Please provide:
     1. Opening hook (0-10 seconds)
@@ -70,27 +158,14 @@ def generate_video_overview(documents):
     
     Format as a video script with timestamps and visual cues.
     """
-    
-    try:
-        response = llm.invoke(prompt)
-        return response.content
-    except Exception as e:
-        return f"Error generating video overview: {str(e)}"
 
-def generate_mind_map(documents):
-    """Generate mind map structure"""
-    if not documents:
-        return "No documents available for mind map generation."
-    
-    text_content = "\n".join([doc.page_content for doc in documents[:5]])
-    
-    llm = ChatOpenAI(model="gpt-4o", temperature=0.3)
-    
-    prompt = f"""
+def mind_map_prompt(text_content):
+    """Prompt for a mind map structure"""
+    return f"""
     Create a mind map structure for the following content. Organize information hierarchically.
     
     Content:
-    {text_content[:2000]}...
+    {text_content}
     
     Please provide a JSON structure representing the mind map with:
     - Main topic (center)
@@ -100,27 +175,14 @@ def generate_mind_map(documents):
     
     Format as JSON with nested structure.
     """
-    
-    try:
-        response = llm.invoke(prompt)
-        return response.content
-    except Exception as e:
-        return f"Error generating mind map: {str(e)}"
 
-def generate_report(documents):
-    """Generate comprehensive report"""
-    if not documents:
-        return "No documents available for report generation."
-    
-    text_content = "\n".join([doc.page_content for doc in documents])
-    
-    llm = ChatOpenAI(model="gpt-4o", temperature=0.3)
-    
-    prompt = f"""
+def report_prompt(text_content):
+    """Prompt for a comprehensive report"""
+    return f"""
     Create a comprehensive report based on the following content.
     
     Content:
-    {text_content[:3000]}...
+    {text_content}
     
     Please provide:
     1. Executive Summary
@@ -131,27 +193,14 @@ def generate_report(documents):
     
     Format as a professional report with clear sections and bullet points.
     """
-    
-    try:
-        response = llm.invoke(prompt)
-        return response.content
-    except Exception as e:
-        return f"Error generating report: {str(e)}"
 
-def generate_flashcards(documents):
-    """Generate flashcards"""
-    if not documents:
-        return "No documents available for flashcard generation."
-    
-    text_content = "\n".join([doc.page_content for doc in documents[:5]])
-    
-    llm = ChatOpenAI(model="gpt-4o", temperature=0.3)
-    
-    prompt = f"""
+def flashcards_prompt(text_content):
+    """Prompt for flashcards"""
+    return f"""
     Create flashcards based on the following content. Generate 10-15 flashcards.
     
     Content:
-    {text_content[:2000]}...
+    {text_content}
     
     Format each flashcard as:
     Front: [Question or term]
@@ -159,27 +208,14 @@ def generate_flashcards(documents):
     
     Provide flashcards covering the most important concepts.
     """
-    
-    try:
-        response = llm.invoke(prompt)
-        return response.content
-    except Exception as e:
-        return f"Error generating flashcards: {str(e)}"
 
-def generate_quiz(documents):
-    """Generate quiz questions"""
-    if not documents:
-        return "No documents available for quiz generation."
-    
-    text_content = "\n".join([doc.page_content for doc in documents[:5]])
-    
-    llm = ChatOpenAI(model="gpt-4o", temperature=0.3)
-    
-    prompt = f"""
+def quiz_prompt(text_content):
+    """Prompt for quiz questions"""
+    return f"""
     Create a quiz based on the following content. Generate 10 multiple choice questions.
     
     Content:
-    {text_content[:2000]}...
+    {text_content}
     
     Format each question as:
     Question: [Question text]
@@ -192,12 +228,148 @@ def generate_quiz(documents):
     
     Include questions of varying difficulty levels.
     """
+
+# Bump when any Studio prompt changes so cached outputs from the old prompts are not reused
+STUDIO_PROMPT_VERSION = 2
+
+# Prompt, name used in messages and context budget of every Studio output
+STUDIO_OUTPUTS = {
+    "Audio Overview": (audio_overview_prompt, "audio overview", STUDIO_CONTEXT_TOKENS),
+    "Video Overview": (video_overview_prompt, "video overview", STUDIO_CONTEXT_TOKENS),
+    "Mind Map": (mind_map_prompt, "mind map", STUDIO_CONTEXT_TOKENS),
+    "Report": (report_prompt, "report", REPORT_CONTEXT_TOKENS),
+    "Flashcards": (flashcards_prompt, "flashcards", STUDIO_CONTEXT_TOKENS),
+    "Quiz": (quiz_prompt, "quiz", STUDIO_CONTEXT_TOKENS),
+}
+# Studio requests one session may have in flight at once when generating several outputs
+STUDIO_CONCURRENCY = int(os.environ.get("STUDY_BUDDY_STUDIO_CONCURRENCY", 3))
+
+def generate_studio_output(output_type, documents, callbacks=None, context=None, **kwargs):
+    """Generate one Studio output; ``context`` is a precomputed corpus digest"""
+    make_prompt, label, context_tokens = STUDIO_OUTPUTS[output_type]
+    if not documents:
+        return f"No documents available for {label} generation."
     
+    if context is None:
+        context = corpus_context(documents, context_tokens)
+    llm = get_chat_model("gpt-4o", temperature=0.3, streaming=True)
     try:
-        response = llm.invoke(prompt)
+        response = llm.invoke(make_prompt(context, **kwargs), config={"callbacks": callbacks})
         return response.content
     except Exception as e:
-        return f"Error generating quiz: {str(e)}"
+        return f"Error generating {label}: {str(e)}"
+
+async def agenerate_studio_output(output_type, context, **kwargs):
+    """Async version of ``generate_studio_output`` for a precomputed context"""
+    make_prompt, label, _ = STUDIO_OUTPUTS[output_type]
+    llm = get_chat_model("gpt-4o", temperature=0.3)
+    try:
+        response = await llm.ainvoke(make_prompt(context, **kwargs))
+        return response.content
+    except Exception as e:
+        return f"Error generating {label}: {str(e)}"
+
+def studio_cache_key(output_type, documents, options):
+    return make_key(documents_fingerprint(documents), output_type, options, STUDIO_PROMPT_VERSION)
+
+def run_studio_generator(output_type, documents, regenerate=False, callbacks=None, **kwargs):
+    """Run a Studio generator, reusing a cached result for the same documents and options.
+
+    ``callbacks`` receive the tokens of a freshly generated output.
+    """
+    if not documents:
+        return generate_studio_output(output_type, documents, **kwargs)
+
+    cache = StudioCache()
+    key = studio_cache_key(output_type, documents, kwargs)
+    if not regenerate:
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+    result = generate_studio_output(output_type, documents, callbacks=callbacks, **kwargs)
+    # Failures come back as "Error generating ..." text and must not be cached
+    if not result.startswith("Error generating"):
+        cache.put(key, result)
+    return result
+
+async def generate_studio_outputs(requests, documents, concurrency=STUDIO_CONCURRENCY):
+    """Generate several Studio outputs at once, yielding ``(output_type, result)`` as each finishes.
+
+    ``requests`` maps output type to its options. Cached outputs come back
+    first; the rest share one corpus digest per context budget and are sent
+    to the model together with ``ainvoke``, at most ``concurrency`` at a time,
+    so the wait is about that of the slowest output rather than their sum.
+    """
+    cache = StudioCache()
+    keys = {}
+    for output_type, options in requests.items():
+        result = cache.get(studio_cache_key(output_type, documents, options))
+        if result is not None:
+            yield output_type, result
+        else:
+            keys[output_type] = studio_cache_key(output_type, documents, options)
+    if not keys:
+        return
+
+    # The digest is the slow shared step; the map summaries behind it are cached, too
+    budgets = sorted({STUDIO_OUTPUTS[output_type][2] for output_type in keys})
+    digests = await asyncio.gather(*(asyncio.to_thread(corpus_context, documents, budget) for budget in budgets))
+    contexts = dict(zip(budgets, digests))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def generate(output_type):
+        async with semaphore:
+            context = contexts[STUDIO_OUTPUTS[output_type][2]]
+            return output_type, await agenerate_studio_output(output_type, context, **requests[output_type])
+
+    tasks = [asyncio.ensure_future(generate(output_type)) for output_type in keys]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            output_type, result = await finished
+            if not result.startswith("Error generating"):
+                cache.put(keys[output_type], result)
+            yield output_type, result
+    finally:
+        # Abandoned (e.g. by a rerun): don't leave requests running
+        for task in tasks:
+            task.cancel()
+
+def ingest_job(job, store, uploads, splitter):
+    """Background job: add the ``uploads`` the shared corpus doesn't have yet"""
+    manager = store.manager
+    # One ingestion at a time per corpus, so a file uploaded by several sessions is embedded once
+    with manager.ingest_lock:
+        for progress in stream_ingest(manager, uploads, IngestCache(), splitter, splitter.settings, prune=False):
+            if progress["done"] and progress["changed"]:
+                # Large libraries move from exact search to an HNSW/IVF index once fully ingested,
+                # and the corpus is saved so a restart memory-maps it instead of rebuilding it
+                manager.optimize()
+                store.save()
+            job.report(**progress)
+
+def studio_job(job, output_type, documents, regenerate, options):
+    """Background job: one Studio output, with the text generated so far as progress"""
+    stream = TokenStream(lambda callbacks: run_studio_generator(output_type, documents, regenerate, callbacks=callbacks, **options))
+    parts = []
+    published = 0.0
+    for token in stream:
+        parts.append(token)
+        # Joining on every token would copy the text once per token
+        now = time.monotonic()
+        if now - published >= STUDIO_PROGRESS_SECONDS:
+            published = now
+            job.report(text="".join(parts))
+    return stream.result
+
+def studio_batch_job(job, requests, documents):
+    """Background job: several Studio outputs, with the finished ones as progress"""
+    results = {}
+    for output_type, result in iter_async(generate_studio_outputs(requests, documents)):
+        results[output_type] = result
+        job.report(results=results)
+    return results
 
 # Custom CSS for the enhanced professional UI design
 st.markdown("""
@@ -264,59 +436,6 @@ st.markdown("""
         transform: translateY(-1px);
     }
     
-    .api-toggle {
-        display: flex;
-        align-items: center;
-        gap: 0.5rem;
-        padding: 0.5rem 1rem;
-        background: #f8fafc;
-        border: 1px solid #e2e8f0;
-        border-radius: 8px;
-        margin-right: 1rem;
-        cursor: pointer;
-        transition: all 0.2s ease;
-    }
-    
-    .api-toggle:hover {
-        background: #f1f5f9;
-        border-color: #cbd5e1;
-    }
-    
-    .toggle-switch {
-        position: relative;
-        width: 44px;
-        height: 24px;
-        background: #cbd5e1;
-        border-radius: 12px;
-        transition: background-color 0.2s ease;
-    }
-    
-    .toggle-switch.active {
-        background: #10b981;
-    }
-    
-    .toggle-knob {
-        position: absolute;
-        top: 2px;
-        left: 2px;
-        width: 20px;
-        height: 20px;
-        background: white;
-        border-radius: 50%;
-        transition: transform 0.2s ease;
-        box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1);
-    }
-    
-    .toggle-switch.active .toggle-knob {
-        transform: translateX(20px);
-    }
-    
-    .toggle-label {
-        font-size: 14px;
-        font-weight: 500;
-        color: #374151;
-    }
-    
     .upload-header {
         padding: 1rem 2rem;
         background: #f8fafc;
@@ -658,11 +777,20 @@ st.set_page_config(page_title="StudyMate", page_icon="📘", layout="wide", init
 if 'use_local_model' not in st.session_state:
     st.session_state.use_local_model = False
 
-# Add a hidden toggle for API mode
-# use_local = st.toggle("Local Model", value=st.session_state.use_local_model, key="api_toggle", label_visibility="collapsed")
-# st.session_state.use_local_model = use_local
+# Toggle between OpenAI embeddings and the local sentence-transformers model
+use_local = st.toggle("Local Model", value=st.session_state.use_local_model, key="api_toggle")
+st.session_state.use_local_model = use_local
+embedding_backend = "local" if use_local else "openai"
+
+# Vectors from different backends can't share an index, so switching re-indexes the uploads
+if st.session_state.get("embedding_backend") != embedding_backend:
+    if "corpus_view" in st.session_state:
+        st.session_state.corpus_view.close()
+    for key in ("corpus_view", "ingest_key", "qa_chain", "uploaded_files"):
+        st.session_state.pop(key, None)
+    st.session_state.embedding_backend = embedding_backend
 
-# Main header with professional icons and API toggle
+# Main header with professional icons
 st.markdown("""
 <div class="main-header">
     <div class="logo-section">
@@ -670,12 +798,6 @@ st.markdown("""
         <span style="font-size: 18px; font-weight: 600;">StudyMate</span>
     </div>
     <div class="header-actions">
-        <div class="api-toggle" onclick="toggleApiMode()">
-            <span class="toggle-label">Local Model</span>
-            <div class="toggle-switch" id="apiToggle">
-                <div class="toggle-knob"></div>
-            </div>
-        </div>
         <div class="action-icon" title="Share">
             <svg width="18" height="18" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
                 <path d="M4 12v8a2 2 0 0 0 2 2h12a2 2 0 0 0 2-2v-8"></path>
@@ -705,32 +827,6 @@ st.markdown("""
         </div>
     </div>
 </div>
-
-<script>
-function toggleApiMode() {
-    const toggle = document.getElementById('apiToggle');
-    const isActive = toggle.classList.contains('active');
-    
-    if (isActive) {
-        toggle.classList.remove('active');
-        st.session_state.use_local_model = false;
-    } else {
-        toggle.classList.add('active');
-        st.session_state.use_local_model = true;
-    }
-    
-    // Trigger a rerun to update the session state
-    window.parent.postMessage({type: 'streamlit:rerun'}, '*');
-}
-
-// Initialize toggle state
-document.addEventListener('DOMContentLoaded', function() {
-    const toggle = document.getElementById('apiToggle');
-    if (""" + str(st.session_state.use_local_model).lower() + """) {
-        toggle.classList.add('active');
-    }
-});
-</script>
 """, unsafe_allow_html=True)
 
 # Upload section in header
@@ -774,6 +870,183 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def ingest_status():
+    """Progress of the session's ingestion job, which keeps indexing on a worker thread through reruns"""
+    status = get_job_queue().status(st.session_state.ingest_key)
+    manager = st.session_state.corpus_view
+    
+    if status is None or status["status"] == FAILED:
+        del st.session_state.ingest_key
+        st.error(f"Indexing failed: {status['error'] if status else 'job not found'}")
+        return
+    if status["status"] == DONE:
+        try:
+            if manager.vectorstore is not None and "qa_chain" not in st.session_state:
+                st.session_state.qa_chain = build_qa_chain(manager)
+            st.session_state.processed_docs = manager.documents(st.session_state.ingest_files)  # Store processed documents for studio features
+        except Exception as e:
+            # The job stays tracked, so the next poll tries again and pending questions still get answered
+            st.error(f"Could not open the indexed documents, retrying: {str(e)}")
+            return
+        del st.session_state.ingest_key
+        # A full rerun stops the polling and gives the Studio panel every document
+        st.rerun()
+    
+    progress = status["progress"]
+    if progress:
+        rate = manager.embeddings.throughput()["tokens_per_s"] if hasattr(manager.embeddings, "throughput") else 0
+        st.progress(
+            progress["files_done"] / max(progress["files_total"], 1),
+            text=f"Indexing {progress['file']} ({progress['files_done']}/{progress['files_total']} files, "
+                 f"{progress['chunks']} chunks searchable, {rate:,.0f} tokens/s)",
+        )
+    else:
+        st.progress(0.0, text="Waiting for an indexing worker...")
+    # Unlock chat as soon as the first batch is searchable
+    if manager.vectorstore is not None and "qa_chain" not in st.session_state:
+        try:
+            st.session_state.qa_chain = build_qa_chain(manager)
+            st.session_state.processed_docs = manager.documents(st.session_state.ingest_files)
+        except Exception as e:
+            st.session_state.pop("qa_chain", None)
+            st.error(f"Could not open the indexed documents, retrying: {str(e)}")
+            return
+        st.rerun()
+
+def show_studio_output(output_type, options, result):
+    """Make ``result`` the Studio output on display"""
+    st.session_state.studio_output = {
+        "type": output_type,
+        "content": result,
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "options": options,
+    }
+    if output_type == "Audio Overview":
+        st.session_state.studio_output["audio_text"] = result
+    # Narration still rendering for the previous output is no longer needed here
+    st.session_state.pop("audio_job", None)
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def studio_job_status():
+    """The pending Studio output as far as its background job has generated it"""
+    request = st.session_state.studio_job
+    queue = get_job_queue()
+    status = queue.status(request["key"])
+    if status is None or status["status"] == FAILED:
+        del st.session_state.studio_job
+        st.error(f"Error generating {request['type']}: {status['error'] if status else 'job not found'}")
+        return
+    if status["status"] == DONE:
+        del st.session_state.studio_job
+        show_studio_output(request["type"], request["options"], queue.result(request["key"]))
+        st.rerun()
+    
+    st.info(f"Generating {request['type']}...")
+    text = (status["progress"] or {}).get("text")
+    if text:
+        st.markdown(text)
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def studio_batch_status():
+    """Outputs of the pending Studio batch, each shown as soon as its background job has it"""
+    batch = st.session_state.studio_batch_job
+    queue = get_job_queue()
+    status = queue.status(batch["key"])
+    if status is None or status["status"] == FAILED:
+        del st.session_state.studio_batch_job
+        st.error(f"Error generating outputs: {status['error'] if status else 'job not found'}")
+        return
+    if status["status"] == DONE:
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        del st.session_state.studio_batch_job
+        st.session_state.studio_batch = {
+            output_type: {"type": output_type, "content": result, "timestamp": timestamp, "options": batch["requests"][output_type]}
+            for output_type, result in queue.result(batch["key"]).items()
+        }
+        st.rerun()
+    
+    results = (status["progress"] or {}).get("results", {})
+    for output_type in batch["requests"]:
+        if output_type in results:
+            with st.expander(output_type, expanded=False):
+                st.markdown(results[output_type])
+        else:
+            st.info(f"Generating {output_type}...")
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def audio_status():
+    """Parts of the Audio Overview narration, playable as soon as the TTS job has rendered them"""
+    status = get_job_queue().status(st.session_state.audio_job)
+    if status is None or status["status"] == FAILED:
+        del st.session_state.audio_job
+        # Kept with the output so the failed narration isn't retried on every rerun
+        st.session_state.studio_output["audio_error"] = status["error"] if status else "job not found"
+        st.rerun()
+    if status["status"] == DONE:
+        del st.session_state.audio_job
+        st.rerun()
+    
+    progress = status["progress"] or {}
+    segments = [path for path in progress.get("segments", []) if os.path.exists(path)]
+    st.caption(f"Rendering audio ({len(segments)}/{progress.get('total', '?')} parts ready)...")
+    for path in segments:
+        st.audio(path, format="audio/wav")
+
+@st.fragment
+def chat_panel():
+    """Chat history and input; a question reruns only this fragment and is answered in the same pass"""
+    # Initialize chat history
+    if "chat_history" not in st.session_state:
+        st.session_state.chat_history = []
+    
+    # Messages go above the input, which has to be read first to show the new question
+    history_box = st.container()
+    stats_slot = st.empty()
+    user_query = st.chat_input("Ask something about your documents...")
+    if user_query:
+        # A new question stops any answer still being streamed
+        if "active_stream" in st.session_state:
+            st.session_state.pop("active_stream").cancel()
+        # Unanswered until the first batch of chunks is searchable
+        st.session_state.chat_history.append((user_query, None))
+    
+    # Display chat history; pending answers get a placeholder they are streamed into
+    history = st.session_state.chat_history
+    with history_box:
+        for i, (user_msg, bot_msg) in enumerate(history):
+            with st.chat_message("user"):
+                st.write(user_msg)
+            with st.chat_message("assistant"):
+                answer_slot = st.empty()
+                answer_slot.write(bot_msg or "Processing your question...")
+            if bot_msg is not None or "qa_chain" not in st.session_state:
+                continue
+            # Questions asked before the documents were searchable are answered in order,
+            # each with the answers before it as its history
+            manager = st.session_state.corpus_view
+            # Answers are only cached once the whole document set is indexed
+            fingerprint = None
+            if "ingest_key" not in st.session_state:
+                fingerprint = make_key(sorted(st.session_state.ingest_files), embedding_settings(manager.embeddings))
+            try:
+                answer = answer_question(
+                    st.session_state.qa_chain,
+                    user_msg,
+                    history[:i],
+                    manager.embeddings,
+                    fingerprint,
+                    stream_to=answer_slot,
+                )
+            except Exception as e:
+                answer = f"Error processing query: {str(e)}"
+                answer_slot.write(answer)
+            history[i] = (user_msg, answer)
+    
+    answer_cache_stats = get_answer_cache().stats()
+    if answer_cache_stats["hits"] or answer_cache_stats["misses"]:
+        stats_slot.caption(f"Answer cache: {answer_cache_stats['hits']} hits, {answer_cache_stats['misses']} misses")
+
 # Two panel layout: Chat (70%) and Studio (30%)
 col_chat, col_studio = st.columns([7, 3])
 
@@ -792,23 +1065,11 @@ with col_chat:
     if uploaded_files:
         st.markdown("### Chat with your documents")
         
-        # Initialize chat history
-        if "chat_history" not in st.session_state:
-            st.session_state.chat_history = []
+        # Indexing runs in the background; questions can be asked once the first batch is searchable
+        if "ingest_key" in st.session_state:
+            ingest_status()
         
-        # Display chat history
-        for user_msg, bot_msg in st.session_state.chat_history:
-            with st.chat_message("user"):
-                st.write(user_msg)
-            with st.chat_message("assistant"):
-                st.write(bot_msg)
-        
-        # Chat input
-        user_query = st.chat_input("Ask something about your documents...")
-        if user_query:
-            # Process the query (this will be handled by the PDF processing logic below)
-            st.session_state.chat_history.append((user_query, "Processing your question..."))
-            st.rerun()
+        chat_panel()
     else:
         st.markdown("""
         <div class="empty-state">
@@ -872,43 +1133,21 @@ with col_studio:
         # Row 1 - Audio Overview
         if st.button("🎵 Audio Overview", key="audio_btn", help="Generate audio overview", use_container_width=True):
             if uploaded_files and "qa_chain" in st.session_state:
-                with st.spinner("Generating Audio Overview..."):
-                    documents = st.session_state.get("processed_docs", [])
-                    result = generate_audio_overview(documents, languages[selected_language])
-                    st.session_state.studio_output = {
-                        "type": "Audio Overview",
-                        "content": result,
-                        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "audio_text": result
-                    }
+                st.session_state.studio_request = {"type": "Audio Overview", "options": {"language": languages[selected_language]}}
             else:
                 st.warning("Please upload files first!")
         
         # Row 2 - Mind Map
         if st.button("🗺️ Mind Map", key="mindmap_btn", help="Generate mind map", use_container_width=True):
             if uploaded_files and "qa_chain" in st.session_state:
-                with st.spinner("Generating Mind Map..."):
-                    documents = st.session_state.get("processed_docs", [])
-                    result = generate_mind_map(documents)
-                    st.session_state.studio_output = {
-                        "type": "Mind Map",
-                        "content": result,
-                        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }
+                st.session_state.studio_request = {"type": "Mind Map", "options": {}}
             else:
                 st.warning("Please upload files first!")
         
         # Row 3 - Flashcards
         if st.button("🃏 Flashcards", key="flashcards_btn", help="Generate flashcards", use_container_width=True):
             if uploaded_files and "qa_chain" in st.session_state:
-                with st.spinner("Generating Flashcards..."):
-                    documents = st.session_state.get("processed_docs", [])
-                    result = generate_flashcards(documents)
-                    st.session_state.studio_output = {
-                        "type": "Flashcards",
-                        "content": result,
-                        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }
+                st.session_state.studio_request = {"type": "Flashcards", "options": {}}
             else:
                 st.warning("Please upload files first!")
     
@@ -916,69 +1155,104 @@ with col_studio:
         # Row 1 - Video Overview
         if st.button("🎥 Video Overview", key="video_btn", help="Generate video overview", use_container_width=True):
             if uploaded_files and "qa_chain" in st.session_state:
-                with st.spinner("Generating Video Overview..."):
-                    documents = st.session_state.get("processed_docs", [])
-                    result = generate_video_overview(documents)
-                    st.session_state.studio_output = {
-                        "type": "Video Overview",
-                        "content": result,
-                        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }
+                st.session_state.studio_request = {"type": "Video Overview", "options": {}}
             else:
                 st.warning("Please upload files first!")
         
         # Row 2 - Reports
         if st.button("📊 Reports", key="reports_btn", help="Generate report", use_container_width=True):
             if uploaded_files and "qa_chain" in st.session_state:
-                with st.spinner("Generating Report..."):
-                    documents = st.session_state.get("processed_docs", [])
-                    result = generate_report(documents)
-                    st.session_state.studio_output = {
-                        "type": "Report",
-                        "content": result,
-                        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }
+                st.session_state.studio_request = {"type": "Report", "options": {}}
             else:
                 st.warning("Please upload files first!")
         
         # Row 3 - Quiz
         if st.button("❓ Quiz", key="quiz_btn", help="Generate quiz", use_container_width=True):
             if uploaded_files and "qa_chain" in st.session_state:
-                with st.spinner("Generating Quiz..."):
-                    documents = st.session_state.get("processed_docs", [])
-                    result = generate_quiz(documents)
-                    st.session_state.studio_output = {
-                        "type": "Quiz",
-                        "content": result,
-                        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }
+                st.session_state.studio_request = {"type": "Quiz", "options": {}}
             else:
                 st.warning("Please upload files first!")
     
+    # Several outputs can be generated together; each shows up as soon as it is ready
+    batch_types = st.multiselect(
+        "Generate together:",
+        options=list(STUDIO_OUTPUTS),
+        default=["Mind Map", "Report", "Flashcards", "Quiz"],
+        key="studio_batch_types"
+    )
+    if st.button("⚡ Generate selected", key="studio_batch_btn", help="Generate all selected outputs at once", use_container_width=True):
+        if uploaded_files and "qa_chain" in st.session_state:
+            st.session_state.studio_batch_request = batch_types
+        else:
+            st.warning("Please upload files first!")
+    
+    if st.session_state.get("studio_batch_request"):
+        batch_types = st.session_state.pop("studio_batch_request")
+        requests = {t: {"language": languages[selected_language]} if t == "Audio Overview" else {} for t in batch_types}
+        documents = st.session_state.get("processed_docs", [])
+        key = make_key("studio-batch", documents_fingerprint(documents), requests, STUDIO_PROMPT_VERSION)
+        # A finished batch is rerun rather than reused: its outputs come straight back from the
+        # Studio cache, which also holds any that were regenerated since
+        get_job_queue().submit(key, studio_batch_job, requests, documents, kind="studio-batch", force=True)
+        st.session_state.studio_batch_job = {"key": key, "requests": requests}
+    
+    if "studio_batch_job" in st.session_state:
+        studio_batch_status()
+    else:
+        for output_type, output in st.session_state.get("studio_batch", {}).items():
+            with st.expander(output_type, expanded=False):
+                st.markdown(output["content"])
+    
+    # Cached outputs are served instantly; Regenerate skips the cache and asks the model again
+    if "studio_output" in st.session_state:
+        if st.button("🔄 Regenerate", key="regenerate_btn", help="Generate a fresh version", use_container_width=True):
+            output = st.session_state.studio_output
+            st.session_state.studio_request = {"type": output["type"], "options": output.get("options", {}), "regenerate": True}
+    
+    # Requested outputs are generated by a background job and polled, so clicks elsewhere don't lose them;
+    # the same request from any session joins the job already running
+    if "studio_request" in st.session_state:
+        request = st.session_state.pop("studio_request")
+        documents = st.session_state.get("processed_docs", [])
+        regenerate = request.get("regenerate", False)
+        cache_key = studio_cache_key(request["type"], documents, request["options"])
+        # Outputs are served from the Studio cache, never from a finished job, whose stored result
+        # would outlive the cache's TTL; anything the cache doesn't have is generated again
+        result = None if regenerate else StudioCache().get(cache_key)
+        if result is not None:
+            show_studio_output(request["type"], request["options"], result)
+        else:
+            key = make_key("studio", cache_key)
+            get_job_queue().submit(
+                key, studio_job, request["type"], documents, regenerate, request["options"],
+                kind="studio", force=True,
+            )
+            st.session_state.studio_job = {"key": key, "type": request["type"], "options": request["options"]}
+    
+    if "studio_job" in st.session_state:
+        studio_job_status()
+    
     # Studio Output Display
     if "studio_output" in st.session_state:
         output = st.session_state.studio_output
         
         # Add audio functionality for Audio Overview
         if output['type'] == 'Audio Overview' and 'audio_text' in output:
-            # Generate audio using text-to-speech
-            try:
-                import pyttsx3
-                engine = pyttsx3.init()
-                engine.setProperty('rate', 150)  # Speed of speech
-                engine.setProperty('volume', 0.9)  # Volume level
-                
-                # Save audio to file
-                audio_file = "audio_overview.wav"
-                engine.save_to_file(output['audio_text'], audio_file)
-                engine.runAndWait()
-                
-                # Display audio player
-                st.audio(audio_file, format="audio/wav")
-            except ImportError:
+            # Narrations are rendered once by a background TTS job and then served from the audio cache
+            language = output.get('options', {}).get('language', 'English')
+            if not TTS_AVAILABLE:
                 st.info("Audio playback requires pyttsx3. Install with: pip install pyttsx3")
-            except Exception as e:
-                st.error(f"Audio generation failed: {str(e)}")
+            elif 'audio_error' in output:
+                st.error(f"Audio generation failed: {output['audio_error']}")
+            else:
+                tts = get_tts()
+                audio_file = tts.cached(output['audio_text'], language=language)
+                if audio_file:
+                    st.audio(audio_file, format="audio/wav")
+                else:
+                    if "audio_job" not in st.session_state:
+                        st.session_state.audio_job = tts.submit(output['audio_text'], language=language)
+                    audio_status()
         
         st.markdown(f"""
         <div class="studio-output">
@@ -1021,40 +1295,26 @@ with col_studio:
 if uploaded_files:
     # Check if we need to process new files
     if "uploaded_files" not in st.session_state or st.session_state.uploaded_files != uploaded_files:
-        all_docs = []
-        for uploaded_file in uploaded_files:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-                tmp_file.write(uploaded_file.read())
-                tmp_path = tmp_file.name
-
-            loader = PyPDFLoader(tmp_path)
-            documents = loader.load()
-            all_docs.extend(documents)
-
-        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        docs = splitter.split_documents(all_docs)
+        # The worker outlives this run, so it gets its own copy of each upload
+        uploads = {file_sha256(f.getbuffer()): (f.name, f.getvalue()) for f in uploaded_files}
 
-        embeddings = OpenAIEmbeddings()
-        vectorstore = FAISS.from_documents(docs, embeddings)
+        # Every session searches one shared, content-addressed corpus through a view of its own files;
+        # files already indexed for another session are reused as they are
+        store = get_corpus_store(st.session_state.embedding_backend)
+        if "corpus_view" in st.session_state:
+            st.session_state.corpus_view.close()
+        st.session_state.corpus_view = store.view(list(uploads))
+        st.session_state.pop("qa_chain", None)
 
-        qa = ConversationalRetrievalChain.from_llm(
-            ChatOpenAI(model="gpt-4o", temperature=0),
-            vectorstore.as_retriever()
-        )
-
-        # Store the QA chain and documents in session state
-        st.session_state.qa_chain = qa
+        # Indexing runs as a background job keyed by the files and settings, so it survives reruns
+        # and sessions uploading the same files share one job
+        splitter = StructuredChunker(CHUNK_TOKENS)
+        key = make_key("ingest", sorted(uploads), embedding_settings(store.embeddings), splitter.settings)
+        # A finished job's files may have been evicted since
+        force = not set(uploads) <= store.manager.files
+        get_job_queue().submit(key, ingest_job, store, uploads, splitter, kind="ingest", force=force)
+        st.session_state.ingest_key = key
+        st.session_state.ingest_files = list(uploads)
         st.session_state.uploaded_files = uploaded_files
-        st.session_state.processed_docs = docs  # Store processed documents for studio features
-
-# Process chat queries
-if "qa_chain" in st.session_state and "chat_history" in st.session_state:
-    # Check if there's a new query to process
-    if st.session_state.chat_history and st.session_state.chat_history[-1][1] == "Processing your question...":
-        user_query = st.session_state.chat_history[-1][0]
-        try:
-            result = st.session_state.qa_chain({"question": user_query, "chat_history": st.session_state.chat_history[:-1]})
-            st.session_state.chat_history[-1] = (user_query, result["answer"])
-        except Exception as e:
-            st.session_state.chat_history[-1] = (user_query, f"Error processing query: {str(e)}")
+        # Start polling the job
         st.rerun()
@@ -1,49 +1,161 @@
-from PyPDF2 import PdfReader
-from sentence_transformers import SentenceTransformer
-import faiss
-import numpy as np
-from google.colab import files
-from PyPDF2 import PdfReader
-
-
-# Upload the PDF
-uploaded = files.upload()
-
-# Get the uploaded file path
-pdf_path = list(uploaded.keys())[0]
-reader = PdfReader(pdf_path)
-text = ""
-for page in reader.pages:
-    if page.extract_text():
-        text += page.extract_text() + " "
-
-# 2. Split into chunks
-def chunk_text(text, chunk_size=300):
-    words = text.split()
-    for i in range(0, len(words), chunk_size):
-        yield " ".join(words[i:i+chunk_size])
-
-chunks = list(chunk_text(text))
-
-# 3. Embed chunks with sentence-transformers
-model = SentenceTransformer("all-MiniLM-L6-v2")
-embeddings = model.encode(chunks)
-
-# 4. Create FAISS index for retrieval
-dimension = embeddings.shape[1]
-index = faiss.IndexFlatL2(dimension)
-index.add(np.array(embeddings))
-
-# Function to answer questions
-def ask(question, top_k=3):
-    q_embedding = model.encode([question])
-    distances, indices = index.search(np.array(q_embedding), top_k)
-    answers = [chunks[i] for i in indices[0]]
-    return "\n---\n".join(answers)
-
-# 5. Try asking a question
-while True:
-    q = input("Ask a question (or type 'exit'): ")
-    if q.lower() == "exit":
-        break
-    print("\nAnswer:\n", ask(q))
+import json
+import os
+import sys
+from typing import NamedTuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+# Make the shared helpers in the repo-level utils/ package importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.ann_index import build_index
+from utils.bm25 import BM25Index
+from utils.chunk_store import ChunkStore
+from utils.chunker import StructuredChunker
+from utils.hybrid_search import reciprocal_rank_fusion
+from utils.pdf_extract import extract_texts
+from utils.reranker import RERANK_ENABLED, get_reranker
+from utils.resources import get_sentence_transformer
+
+
+# 2. Split into chunks at headings, paragraphs and sentences
+def chunk_pages(pages, source, chunk_tokens=250):
+    """Structured chunks of a PDF's page texts, with page and offset metadata"""
+    documents = (Document(page_content=text, metadata={"source": source, "page": n}) for n, text in enumerate(pages) if text)
+    return StructuredChunker(chunk_tokens).split_documents(documents)
+
+class Corpus(NamedTuple):
+    """Everything retrieval needs for one document, as built by :func:`load_corpus`"""
+    model: object
+    index: object
+    chunks: ChunkStore
+    keywords: BM25Index
+
+def load_corpus(pdf_path, model_name="all-MiniLM-L6-v2"):
+    """Extract, chunk, embed and index a PDF"""
+    # Pages are extracted in parallel across a process pool
+    pages = extract_texts([pdf_path])[0]
+
+    # Chunk text and metadata go to a memory-mapped store; chunk ids are its record ids
+    chunk_docs = chunk_pages(pages, pdf_path)
+    chunks = ChunkStore()
+    chunks.extend(chunk_docs)
+    texts = [doc.page_content for doc in chunk_docs]
+    del chunk_docs, pages
+
+    # BM25 keyword index over the chunks, for exact terms the embeddings miss
+    keywords = BM25Index()
+    keywords.add_many(range(len(texts)), texts)
+
+    # 3. Embed chunks with sentence-transformers (loaded once per process)
+    model = get_sentence_transformer(model_name)
+
+    # 4. Create FAISS index for retrieval (exact for small corpora, HNSW/IVF for large ones). It stores
+    # float16 vectors (STUDY_BUDDY_VECTOR_CODEC=int8 for a quarter of float32), so neither the float32
+    # embeddings nor the text list are kept
+    index = build_index(model.encode(texts))
+    return Corpus(model, index, chunks, keywords)
+
+# Vector and keyword search each contribute this many candidates per answer chunk
+CANDIDATES_PER_RESULT = 4
+# Questions encoded and searched together by ask_batch
+QUESTION_BATCH_SIZE = 1024
+
+def retrieve(corpus, questions, top_k=3, rerank=RERANK_ENABLED):
+    """Chunk ids for each question, from one encode call and one index search for all of them.
+
+    With ``rerank`` every fused candidate is scored by a cross-encoder (all
+    questions' pairs in one batched call) and the best ``top_k`` are kept.
+    """
+    model, index, chunks, keywords = corpus
+    fetch_k = top_k * CANDIDATES_PER_RESULT
+    q_embeddings = model.encode(list(questions), batch_size=64)
+    distances, indices = index.search(np.asarray(q_embeddings, dtype="float32"), fetch_k)
+    results = []
+    for question, row in zip(questions, indices):
+        dense = [int(i) for i in row if i >= 0]
+        sparse = [i for i, _ in keywords.search(question, fetch_k)]
+        # Reciprocal rank fusion rewards chunks ranked well by either search
+        results.append(reciprocal_rank_fusion([dense, sparse]))
+    if not rerank:
+        return [ids[:top_k] for ids in results]
+
+    pairs = [(question, chunks.text(i)) for question, ids in zip(questions, results) for i in ids]
+    scores = iter(get_reranker().score_pairs(pairs))
+    reranked = []
+    for ids in results:
+        ids_scores = [(next(scores), i) for i in ids]
+        reranked.append([i for _, i in sorted(ids_scores, key=lambda pair: pair[0], reverse=True)[:top_k]])
+    return reranked
+
+# Function to answer questions
+def ask(corpus, question, top_k=3):
+    answers = [corpus.chunks.text(i) for i in retrieve(corpus, [question], top_k)[0]]
+    return "\n---\n".join(answers)
+
+def read_questions(source):
+    """Questions from a text file (one per line), a JSONL file ({"question": ...} per line) or an iterable"""
+    if isinstance(source, str):
+        with open(source, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("{"):
+                    line = json.loads(line)["question"]
+                if line:
+                    yield line
+    else:
+        yield from source
+
+def ask_batch(corpus, questions, top_k=3, batch_size=QUESTION_BATCH_SIZE):
+    """Answer a question bank, yielding one result dict per question in order.
+
+    ``questions`` is anything :func:`read_questions` accepts. Each batch of
+    ``batch_size`` questions is encoded together and searched with a single
+    ``index.search`` call, so results stream out while memory stays bounded.
+    """
+    batch = []
+    for question in read_questions(questions):
+        batch.append(question)
+        if len(batch) == batch_size:
+            yield from _answer_batch(corpus, batch, top_k)
+            batch = []
+    if batch:
+        yield from _answer_batch(corpus, batch, top_k)
+
+def _answer_batch(corpus, questions, top_k):
+    for question, ids in zip(questions, retrieve(corpus, questions, top_k)):
+        yield {"question": question, "chunk_ids": ids, "answers": [corpus.chunks.text(i) for i in ids]}
+
+def write_jsonl(results, out):
+    """Write result dicts to ``out`` as JSON lines, flushing after each one"""
+    for result in results:
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
+
+# The guard keeps extraction worker processes from re-running the script
+if __name__ == "__main__":
+    from google.colab import files
+
+    # Upload the PDF
+    uploaded = files.upload()
+
+    # Get the uploaded file path
+    pdf_path = list(uploaded.keys())[0]
+    corpus = load_corpus(pdf_path)
+
+    # 5. Try asking a question, or "batch questions.txt [answers.jsonl]" for a whole question bank
+    while True:
+        q = input("Ask a question (or type 'exit'): ")
+        if q.lower() == "exit":
+            break
+        command, *paths = q.split() or [""]
+        if command == "batch":
+            if not paths:
+                print("Usage: batch questions.txt [answers.jsonl]")
+            elif len(paths) > 1:
+                with open(paths[1], "w", encoding="utf-8") as out:
+                    write_jsonl(ask_batch(corpus, paths[0]), out)
+            else:
+                write_jsonl(ask_batch(corpus, paths[0]), sys.stdout)
+            continue
+        print("\nAnswer:\n", ask(corpus, q))
@@ -0,0 +1 @@
+"""Helper modules shared by the Study Buddy apps (PDF parsing, caching, retrieval)."""
@@ -0,0 +1,257 @@
+import math
+import os
+import time
+
+import faiss
+import numpy as np
+
+# From exact to most compressed; "auto" picks by corpus size
+INDEX_MODES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+INDEX_MODE = os.environ.get("STUDY_BUDDY_INDEX_MODE", "auto")
+# Corpus sizes (in vectors) at which "auto" moves to the next mode
+HNSW_MIN_VECTORS = int(os.environ.get("STUDY_BUDDY_HNSW_MIN_VECTORS", 20000))
+IVF_MIN_VECTORS = int(os.environ.get("STUDY_BUDDY_IVF_MIN_VECTORS", 200000))
+PQ_MIN_VECTORS = int(os.environ.get("STUDY_BUDDY_PQ_MIN_VECTORS", 1000000))
+# Search-time knobs: graph neighbours and breadth for HNSW, lists probed for IVF
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = int(os.environ.get("STUDY_BUDDY_HNSW_EF_SEARCH", 64))
+IVF_NPROBE = int(os.environ.get("STUDY_BUDDY_IVF_NPROBE", 16))
+# k-means wants at least ~39 points per centroid; IVF needs enough points to train at all
+TRAIN_POINTS_PER_LIST = 40
+MIN_TRAIN_VECTORS = 1000
+# How flat, HNSW and IVF-Flat indexes store vectors: "float32" (exact), "float16" (half the
+# memory, practically the same ranking) or "int8" (a quarter, scalar-quantized per dimension)
+VECTOR_CODECS = {
+    "float32": None,
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+VECTOR_CODEC = os.environ.get("STUDY_BUDDY_VECTOR_CODEC", "float16")
+# int8 ranges are learned from a sample and widened by this fraction for vectors added later
+INT8_RANGE_MARGIN = 0.1
+SQ_TRAIN_VECTORS = 10000
+# A growing index stays float16 until it has this many vectors to learn int8 ranges from
+INT8_MIN_VECTORS = int(os.environ.get("STUDY_BUDDY_INT8_MIN_VECTORS", SQ_TRAIN_VECTORS))
+
+
+def choose_mode(n_vectors, mode=INDEX_MODE):
+    """Resolve ``mode`` ("auto" or one of INDEX_MODES) for a corpus of ``n_vectors``"""
+    if mode != "auto":
+        if mode not in INDEX_MODES:
+            raise ValueError(f"Unknown index mode {mode!r}, expected 'auto' or one of {INDEX_MODES}")
+        # IVF can't be trained on a handful of vectors
+        if mode.startswith("ivf") and n_vectors < MIN_TRAIN_VECTORS:
+            return "flat"
+        return mode
+    if n_vectors >= PQ_MIN_VECTORS:
+        return "ivf_pq"
+    if n_vectors >= IVF_MIN_VECTORS:
+        return "ivf_flat"
+    if n_vectors >= HNSW_MIN_VECTORS:
+        return "hnsw"
+    return "flat"
+
+
+def choose_codec(n_vectors, codec=VECTOR_CODEC):
+    """Resolve ``codec`` for an index that holds ``n_vectors`` and may keep growing.
+
+    int8 ranges learned from the first few documents clip the vectors of
+    later ones, so small corpora are stored as float16 and move to int8 when
+    they are rebuilt at INT8_MIN_VECTORS or more.
+    """
+    if codec == "int8" and n_vectors < INT8_MIN_VECTORS:
+        return "float16"
+    return codec
+
+
+def index_mode(index):
+    """Which of INDEX_MODES an index built by :func:`build_index` uses"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def supports_removal(index):
+    """HNSW graphs can't delete vectors; every other mode can"""
+    return index_mode(index) != "hnsw"
+
+
+def _nlist(n_vectors):
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // TRAIN_POINTS_PER_LIST))
+
+
+def _pq_subquantizers(dimension):
+    # One byte per 4 dimensions (16x smaller than float32); PQ needs m to divide d
+    m = max(1, dimension // 4)
+    while dimension % m:
+        m -= 1
+    return m
+
+
+def index_codec(index):
+    """Which of VECTOR_CODECS an index stores its vectors as (None for IVF-PQ)"""
+    sq = _scalar_quantizer(index)
+    if sq is not None:
+        return "float16" if sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "int8"
+    return None if index_mode(index) == "ivf_pq" else "float32"
+
+
+def _int8_ranges(index):
+    """``(vmin, vmax)`` per dimension of a trained int8 index, or None"""
+    sq = _scalar_quantizer(index)
+    if sq is None or sq.qtype != faiss.ScalarQuantizer.QT_8bit or not index.is_trained:
+        return None
+    trained = faiss.vector_to_array(sq.trained)
+    return trained[:sq.d], trained[:sq.d] + trained[sq.d:]
+
+
+def _scalar_quantizer(index):
+    """The ``ScalarQuantizer`` an index stores its vectors with, or None"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    return getattr(index, "sq", None)
+
+
+def make_index(dimension, mode, n_vectors, codec=VECTOR_CODEC):
+    """Empty index for ``mode`` sized for about ``n_vectors``, searchable by custom ids.
+
+    IVF indexes store ids natively (with a hash table so vectors can be
+    reconstructed and removed by id); flat and HNSW indexes are wrapped in an
+    ``IndexIDMap2``. Vectors are stored as ``codec`` (see VECTOR_CODECS;
+    IVF-PQ has its own compression). IVF and int8 indexes still need
+    :func:`train_index`.
+    """
+    if codec not in VECTOR_CODECS:
+        raise ValueError(f"Unknown vector codec {codec!r}, expected one of {tuple(VECTOR_CODECS)}")
+    qtype = VECTOR_CODECS[codec]
+    nlist = _nlist(n_vectors)
+    if mode == "flat":
+        base = faiss.IndexFlatL2(dimension) if qtype is None else faiss.IndexScalarQuantizer(dimension, qtype)
+        index = faiss.IndexIDMap2(base)
+    elif mode == "hnsw":
+        base = faiss.IndexHNSWFlat(dimension, HNSW_M) if qtype is None else faiss.IndexHNSWSQ(dimension, qtype, HNSW_M)
+        base.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        base.hnsw.efSearch = HNSW_EF_SEARCH
+        index = faiss.IndexIDMap2(base)
+    elif mode == "ivf_flat":
+        storage = {"float32": "Flat", "float16": "SQfp16", "int8": "SQ8"}[codec]
+        index = faiss.index_factory(dimension, f"IVF{nlist},{storage}")
+    elif mode == "ivf_pq":
+        index = faiss.index_factory(dimension, f"IVF{nlist},PQ{_pq_subquantizers(dimension)}x8")
+    else:
+        raise ValueError(f"Unknown index mode {mode!r}")
+    sq = _scalar_quantizer(index)
+    if sq is not None and sq.qtype == faiss.ScalarQuantizer.QT_8bit:
+        # Leave headroom for vectors outside the training sample's range
+        sq.rangestat = faiss.ScalarQuantizer.RS_minmax
+        sq.rangestat_arg = INT8_RANGE_MARGIN
+    if mode.startswith("ivf"):
+        index.nprobe = min(IVF_NPROBE, nlist)
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return index
+
+
+def train_index(index, vectors, seed=0):
+    """Train an IVF or int8 index on a random sample of ``vectors`` (no-op for other indexes)"""
+    if index.is_trained:
+        return
+    ivf = faiss.try_extract_index_ivf(index)
+    size = min(len(vectors), ivf.nlist * TRAIN_POINTS_PER_LIST if ivf is not None else SQ_TRAIN_VECTORS)
+    if size < len(vectors):
+        sample = np.random.default_rng(seed).choice(len(vectors), size, replace=False)
+        vectors = vectors[np.sort(sample)]
+    index.train(np.ascontiguousarray(vectors, dtype="float32"))
+
+
+def build_index(vectors, mode=INDEX_MODE, ids=None, codec=VECTOR_CODEC, like=None):
+    """Index ``vectors`` (with ``ids``, default 0..n-1) in ``mode``, resolving "auto" by size.
+
+    When rebuilding an int8 flat or HNSW index, pass it as ``like``: its
+    value ranges are reused, since learning them again from vectors it has
+    already quantized would widen them by the margin on every rebuild.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if ids is None:
+        ids = np.arange(len(vectors))
+    mode = choose_mode(len(vectors), mode)
+    index = make_index(vectors.shape[1], mode, len(vectors), codec)
+    ranges = _int8_ranges(like) if like is not None and not mode.startswith("ivf") else None
+    sq = _scalar_quantizer(index)
+    if ranges is not None and sq is not None and sq.qtype == faiss.ScalarQuantizer.QT_8bit:
+        sq.rangestat_arg = 0.0
+        index.train(np.stack(ranges).astype("float32"))
+    else:
+        train_index(index, vectors)
+    index.add_with_ids(vectors, np.asarray(ids, dtype="int64"))
+    return index
+
+
+def recall_report(vectors, modes=INDEX_MODES, k=10, n_queries=200, seed=0, codec=VECTOR_CODEC):
+    """Recall@k and search latency of each mode, measured against exact search.
+
+    ``n_queries`` vectors are held out as queries and the rest are indexed.
+    Returns one dict per mode with ``recall``, ``ms_per_query`` (one query at
+    a time, as the apps search), ``build_s`` and serialized ``bytes``.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(vectors))
+    queries, corpus = vectors[order[:n_queries]], vectors[order[n_queries:]]
+    exact = faiss.IndexFlatL2(corpus.shape[1])
+    exact.add(corpus)
+    _, truth = exact.search(queries, k)
+
+    rows = []
+    for mode in modes:
+        start = time.perf_counter()
+        index = build_index(corpus, mode, codec=codec)
+        build_s = time.perf_counter() - start
+        start = time.perf_counter()
+        found = [index.search(queries[i:i + 1], k)[1][0] for i in range(len(queries))]
+        ms_per_query = (time.perf_counter() - start) * 1000 / len(queries)
+        hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+        rows.append({
+            "mode": index_mode(index),
+            "recall": hits / truth.size,
+            "ms_per_query": ms_per_query,
+            "build_s": build_s,
+            "bytes": len(faiss.serialize_index(index)),
+        })
+    return rows
+
+
+def format_report(rows):
+    """Plain-text table of :func:`recall_report` rows"""
+    lines = [f"{'mode':<10}{'recall':>8}{'ms/query':>10}{'build s':>9}{'MB':>9}"]
+    for row in rows:
+        lines.append(f"{row['mode']:<10}{row['recall']:>8.3f}{row['ms_per_query']:>10.3f}"
+                     f"{row['build_s']:>9.1f}{row['bytes'] / 1024 ** 2:>9.1f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Recall vs latency of the FAISS index modes")
+    parser.add_argument("vectors", nargs="?", help=".npy file of embeddings (random vectors if omitted)")
+    parser.add_argument("--count", type=int, default=100000, help="number of random vectors")
+    parser.add_argument("--dimension", type=int, default=384, help="dimension of random vectors")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--codec", choices=list(VECTOR_CODECS), default=VECTOR_CODEC, help="vector storage")
+    args = parser.parse_args()
+    if args.vectors:
+        data = np.load(args.vectors, mmap_mode="r")
+    else:
+        data = np.random.default_rng(0).standard_normal((args.count, args.dimension), dtype="float32")
+    print(format_report(recall_report(data, k=args.k, codec=args.codec)))
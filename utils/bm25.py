@@ -0,0 +1,147 @@
+import math
+import re
+import threading
+from array import array
+from collections import Counter
+
+import numpy as np
+
+# Words kept whole: "3.2", "x-ray" and "h2o" are single terms
+TOKEN_RE = re.compile(r"\w+(?:[.\-]\w+)*")
+# Too common to help ranking, and their postings would cover nearly every chunk
+STOPWORDS = frozenset(
+    "a an and are as at be but by do does for from has have how i if in into is it its of on or so "
+    "than that the their then there these they this to was were what when where which who why will "
+    "with you your".split()
+)
+
+
+def tokenize(text):
+    """Lowercased search terms of ``text`` without stopwords"""
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 keyword index with array-backed postings.
+
+    Each term maps to two growable arrays (document ids and term frequencies)
+    that numpy reads in place, so a query is a few vectorized gathers over the
+    postings of its terms plus one partial sort. Documents are added with
+    integer ids that must not be reused; removed documents are masked out and
+    their postings dropped once they outnumber the live ones. Document
+    frequencies count masked documents until then, as in most search engines.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.n_docs = 0
+        self.total_length = 0
+        self._postings = {}
+        # Indexed by document id
+        self._lengths = array("f")
+        self._alive = bytearray()
+        self._removed = 0
+        self._norm = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_norm"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.n_docs
+
+    def add(self, doc_id, text):
+        self.add_many([doc_id], [text])
+
+    def add_many(self, doc_ids, texts):
+        """Index ``texts`` under the matching ``doc_ids``"""
+        with self._lock:
+            for doc_id, text in zip(doc_ids, texts):
+                terms = tokenize(text)
+                for term, freq in Counter(terms).items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = self._postings[term] = (array("q"), array("f"))
+                    postings[0].append(doc_id)
+                    postings[1].append(freq)
+                if doc_id >= len(self._lengths):
+                    grow = doc_id + 1 - len(self._lengths)
+                    self._lengths.extend([0.0] * grow)
+                    self._alive.extend(bytes(grow))
+                self._lengths[doc_id] = len(terms)
+                self._alive[doc_id] = 1
+                self.n_docs += 1
+                self.total_length += len(terms)
+            self._norm = None
+
+    def remove(self, doc_ids):
+        """Stop returning ``doc_ids`` from searches"""
+        with self._lock:
+            for doc_id in doc_ids:
+                if doc_id < len(self._alive) and self._alive[doc_id]:
+                    self._alive[doc_id] = 0
+                    self.n_docs -= 1
+                    self.total_length -= int(self._lengths[doc_id])
+                    self._removed += 1
+            if self._removed > self.n_docs:
+                self._compact()
+            self._norm = None
+
+    def _compact(self):
+        alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+        postings = {}
+        for term, (ids, freqs) in self._postings.items():
+            ids_view = np.frombuffer(ids, dtype=np.int64)
+            keep = alive[ids_view]
+            if keep.all():
+                postings[term] = (ids, freqs)
+            elif keep.any():
+                freqs_view = np.frombuffer(freqs, dtype=np.float32)
+                postings[term] = (array("q", ids_view[keep].tobytes()), array("f", freqs_view[keep].tobytes()))
+        self._postings = postings
+        self._removed = 0
+
+    def search(self, query, k=10, mask=None):
+        """Best ``k`` ``(doc_id, score)`` pairs for ``query``, highest score first.
+
+        ``mask`` is an optional boolean array over document ids; only ids
+        where it is True (and that it covers) are returned.
+        """
+        with self._lock:
+            terms = [t for t in set(tokenize(query)) if t in self._postings]
+            if not terms or not self.n_docs:
+                return []
+            if self._norm is None:
+                # Per-document length normalization, reused until the index changes
+                lengths = np.frombuffer(self._lengths, dtype=np.float32)
+                average = self.total_length / self.n_docs or 1.0
+                self._norm = self.k1 * (1 - self.b + self.b * lengths / average)
+            norm = self._norm
+            scores = np.zeros(len(norm), dtype=np.float32)
+            for term in terms:
+                ids, freqs = self._postings[term]
+                ids = np.frombuffer(ids, dtype=np.int64)
+                freqs = np.frombuffer(freqs, dtype=np.float32)
+                df = len(ids)
+                idf = math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+                scores[ids] += idf * freqs * (self.k1 + 1) / (freqs + norm[ids])
+            if self._removed:
+                scores[np.frombuffer(self._alive, dtype=np.uint8) == 0] = 0
+        if mask is not None:
+            covered = min(len(mask), len(scores))
+            scores[:covered][~mask[:covered]] = 0
+            scores[covered:] = 0
+        if len(scores) > k:
+            hits = np.argpartition(scores, -k)[-k:]
+        else:
+            hits = np.arange(len(scores))
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(int(i), float(scores[i])) for i in hits if scores[i] > 0]
@@ -0,0 +1,220 @@
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from array import array
+from collections.abc import Mapping
+
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+from utils.ingest_cache import CACHE_DIR
+
+# Working files of live chunk stores; each is deleted when its store goes away
+CHUNK_DIR = os.path.join(CACHE_DIR, "chunk_store")
+
+
+def _document(page_content, metadata):
+    return Document(page_content=page_content, metadata=metadata)
+
+
+class Chunk:
+    """Handle on one stored chunk that reads its text and metadata on demand.
+
+    Stands in for a ``Document`` wherever only ``page_content`` and
+    ``metadata`` are read, at the cost of two slots instead of a copy of the
+    text and a metadata dict. Pickles as a plain ``Document``.
+    """
+
+    __slots__ = ("store", "id")
+
+    def __init__(self, store, id):
+        self.store = store
+        self.id = id
+
+    @property
+    def page_content(self):
+        return self.store.text(self.id)
+
+    @property
+    def metadata(self):
+        return self.store.metadata(self.id)
+
+    def to_document(self):
+        return Document(page_content=self.page_content, metadata=self.metadata)
+
+    def __reduce__(self):
+        return _document, (self.page_content, self.metadata)
+
+    def __repr__(self):
+        return f"Chunk(id={self.id}, page_content={self.page_content[:40]!r}...)"
+
+
+class ChunkStore(Docstore):
+    """Append-only, memory-mapped store of chunk texts and metadata.
+
+    Records are written back to back into one file (UTF-8 text followed by
+    compact JSON metadata) and found through a single ``array`` of byte
+    offsets, so an indexed chunk costs 16 bytes of RAM plus whatever pages
+    of the file the OS keeps cached. Record ids are assigned in order from 0
+    and never reused; deleted records are only masked, and their space is
+    reclaimed by moving the live ones to a new store with :meth:`copy`.
+
+    It is also a LangChain ``Docstore`` (ids are the record numbers as
+    strings, see :class:`ChunkIds`), so it can back a ``FAISS`` vector store.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            os.makedirs(CHUNK_DIR, exist_ok=True)
+            fd, path = tempfile.mkstemp(dir=CHUNK_DIR, suffix=".chunks")
+            os.close(fd)
+        self.path = path
+        # Record i's text is bytes [2i, 2i+1) and its metadata [2i+1, 2i+2) of these offsets
+        self._offsets = array("q", [0])
+        self._alive = bytearray()
+        self._file = open(path, "w+b")
+        self._map = None
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, ChunkStore._cleanup, self._file, path)
+
+    @staticmethod
+    def _cleanup(file, path):
+        file.close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def __len__(self):
+        return len(self._alive)
+
+    def __getitem__(self, chunk_id):
+        return Chunk(self, chunk_id)
+
+    def extend(self, documents):
+        """Append documents (anything with ``page_content`` and ``metadata``); returns their ids"""
+        with self._lock:
+            start = len(self._alive)
+            end = self._offsets[-1]
+            self._file.seek(end)
+            for doc in documents:
+                text = doc.page_content.encode("utf-8", "surrogatepass")
+                meta = json.dumps(doc.metadata, separators=(",", ":"), default=str).encode("utf-8")
+                self._file.write(text)
+                self._file.write(meta)
+                end += len(text)
+                self._offsets.append(end)
+                end += len(meta)
+                self._offsets.append(end)
+                self._alive.append(1)
+            self._file.flush()
+            return range(start, len(self._alive))
+
+    def _read(self, start, end):
+        with self._lock:
+            if self._map is None or end > len(self._map):
+                # The file grew past the current mapping
+                if self._map is not None:
+                    self._map.close()
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._offsets[-1] else None
+            return self._map[start:end] if self._map is not None else b""
+
+    def text(self, chunk_id):
+        offsets = self._offsets
+        return self._read(offsets[2 * chunk_id], offsets[2 * chunk_id + 1]).decode("utf-8", "surrogatepass")
+
+    def metadata(self, chunk_id):
+        offsets = self._offsets
+        return json.loads(self._read(offsets[2 * chunk_id + 1], offsets[2 * chunk_id + 2]))
+
+    def document(self, chunk_id):
+        """The chunk as a LangChain ``Document``"""
+        return Document(page_content=self.text(chunk_id), metadata=self.metadata(chunk_id))
+
+    def alive(self, chunk_id):
+        return 0 <= chunk_id < len(self._alive) and bool(self._alive[chunk_id])
+
+    def delete(self, ids):
+        """Mask records; :meth:`save` writes them out empty and :meth:`copy` leaves them out"""
+        for chunk_id in ids:
+            self._alive[int(chunk_id)] = 0
+
+    def search(self, search):
+        chunk_id = int(search)
+        if not self.alive(chunk_id):
+            return f"ID {search} not found."
+        return self.document(chunk_id)
+
+    def copy(self, ids):
+        """A new store holding records ``ids``, renumbered from 0 in that order"""
+        store = ChunkStore()
+        with self._lock:
+            self._file.flush()
+        offsets = self._offsets
+        with open(self.path, "rb") as src:
+            for chunk_id in ids:
+                start, split, end = offsets[2 * chunk_id], offsets[2 * chunk_id + 1], offsets[2 * chunk_id + 2]
+                src.seek(start)
+                store._file.write(src.read(end - start))
+                store._offsets.append(store._offsets[-1] + split - start)
+                store._offsets.append(store._offsets[-1] + end - split)
+                store._alive.append(1)
+        store._file.flush()
+        return store
+
+    def save(self, path):
+        """Write a compacted copy (deleted records emptied, ids kept) to ``path``; returns its offsets"""
+        with self._lock:
+            self._file.flush()
+            offsets = array("q", [0])
+            with open(self.path, "rb") as src, open(path, "wb") as dst:
+                for chunk_id, alive in enumerate(self._alive):
+                    if alive:
+                        start, end = self._offsets[2 * chunk_id], self._offsets[2 * chunk_id + 2]
+                        src.seek(start)
+                        dst.write(src.read(end - start))
+                        text_size = self._offsets[2 * chunk_id + 1] - start
+                        offsets.append(offsets[-1] + text_size)
+                        offsets.append(offsets[-1] + end - start - text_size)
+                    else:
+                        dst.write(b"{}")
+                        offsets.append(offsets[-1])
+                        offsets.append(offsets[-1] + 2)
+        return {"offsets": offsets, "alive": bytes(self._alive)}
+
+    @classmethod
+    def load(cls, path, state):
+        """Open a copy of a store written by :meth:`save` (the saved file itself is left untouched)"""
+        store = cls()
+        with store._lock:
+            with open(path, "rb") as src:
+                shutil.copyfileobj(src, store._file)
+            store._file.flush()
+            store._offsets = array("q", state["offsets"])
+            store._alive = bytearray(state["alive"])
+        return store
+
+
+class ChunkIds(Mapping):
+    """``index_to_docstore_id`` for a FAISS store backed by a :class:`ChunkStore`.
+
+    Vector ids are record ids, so the mapping is computed rather than stored.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, chunk_id):
+        if not self.store.alive(chunk_id):
+            raise KeyError(chunk_id)
+        return str(chunk_id)
+
+    def __iter__(self):
+        return (i for i in range(len(self.store)) if self.store.alive(i))
+
+    def __len__(self):
+        return sum(self.store._alive)
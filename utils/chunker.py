@@ -0,0 +1,180 @@
+import os
+import re
+
+from langchain_core.documents import Document
+
+from utils.tokens import count_tokens
+
+# Target chunk size in tokens (about the 1000 characters the old splitter used)
+CHUNK_TOKENS = int(os.environ.get("STUDY_BUDDY_CHUNK_TOKENS", 250))
+# Bump when the chunking rules change so cached chunks are rebuilt
+CHUNKER_VERSION = 2
+
+# "## Intro", "Chapter 4 Genetics", "KEY TERMS"
+HEADING_RE = re.compile(
+    r"^(?:#{1,6}\s+\S.*"
+    r"|(?:Chapter|Section|Part|Unit|Appendix)\s+\w+[.:]?\s+\S.*"
+    r"|[A-Z][A-Z0-9 ,&/:()\-]+)$"
+)
+# "2.3 Cell division", "IV. Results"; wrapped sentences also put numbers at the start of a line
+# ("42 percent of organisms ..."), so these must be short and start a capitalized title
+NUMBERED_HEADING_RE = re.compile(r"^(?:\d+(?:\.\d+)*\.?|[IVXLC]+\.)\s+[A-Z]")
+MAX_NUMBERED_HEADING_WORDS = 10
+MAX_HEADING_CHARS = 100
+SENTENCE_END_RE = re.compile(r"(?:(?<=[.!?])|(?<=[.!?][\"')\]]))\s+(?=[\"'(\[]?[A-Z0-9])")
+
+
+def is_heading(line, continues=False):
+    """Whether a single line of extracted text looks like a section heading.
+
+    ``continues`` means the line follows a paragraph line that stops
+    mid-sentence. Numbered and title-case lines there are most likely the
+    sentence wrapping, so only explicitly marked headings count.
+    """
+    if len(line) > MAX_HEADING_CHARS or line.endswith((".", ",", ";")):
+        return False
+    if HEADING_RE.match(line):
+        return True
+    if continues:
+        return False
+    words = line.split()
+    if NUMBERED_HEADING_RE.match(line):
+        return len(words) <= MAX_NUMBERED_HEADING_WORDS
+    return 0 < len(words) <= 8 and line.istitle()
+
+
+def iter_blocks(text):
+    """Yield ``(kind, offset, text)`` for the headings and paragraphs of one page.
+
+    ``kind`` is "heading" or "paragraph" and ``offset`` is where the block
+    starts in ``text``. Lines of a paragraph are joined with spaces, and words
+    hyphenated across a line break are rejoined.
+    """
+    lines = []
+    start = None
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        line_start = offset + len(line) - len(line.lstrip())
+        offset += len(line)
+        continues = bool(lines) and not lines[-1].endswith((".", "!", "?"))
+        if not stripped or is_heading(stripped, continues):
+            if lines:
+                yield "paragraph", start, _join_lines(lines)
+                lines = []
+            if stripped:
+                yield "heading", line_start, stripped
+            continue
+        if not lines:
+            start = line_start
+        lines.append(stripped)
+    if lines:
+        yield "paragraph", start, _join_lines(lines)
+
+
+def _join_lines(lines):
+    parts = [lines[0]]
+    for line in lines[1:]:
+        if parts[-1].endswith("-") and line[:1].islower():
+            parts[-1] = parts[-1][:-1]
+            parts.append(line)
+        else:
+            parts.append(" " + line)
+    return "".join(parts)
+
+
+def split_sentences(text):
+    return [s for s in SENTENCE_END_RE.split(text) if s.strip()]
+
+
+class StructuredChunker:
+    """Single-pass chunker that cuts at headings, then paragraphs, then sentences.
+
+    Pages are consumed as a stream and chunks are yielded as soon as they are
+    full, so splitting keeps up with extraction. A heading always starts a new
+    chunk and is kept at its top; paragraphs are packed together up to
+    ``chunk_tokens``, a paragraph that doesn't fit is split at sentence
+    boundaries, and only a sentence longer than a whole chunk is cut between
+    words. Chunks don't overlap. Each chunk keeps the metadata of the page it
+    starts on plus ``start_index`` (its offset in that page's text, approximate
+    when the chunk starts mid-paragraph) and the ``heading`` of its section.
+    """
+
+    def __init__(self, chunk_tokens=CHUNK_TOKENS, model=None):
+        self.chunk_tokens = chunk_tokens
+        self.model = model
+
+    @property
+    def settings(self):
+        """Everything that affects the output, for cache keys"""
+        return {"chunker": "structured", "chunk_tokens": self.chunk_tokens, "version": CHUNKER_VERSION}
+
+    def split_documents(self, documents):
+        return list(self.iter_split(documents))
+
+    def iter_split(self, pages):
+        """Yield chunk Documents for a stream of page Documents in reading order"""
+        parts = []
+        tokens = 0
+        metadata = None
+        heading = None
+        has_body = False
+
+        def flush():
+            nonlocal parts, tokens, has_body
+            chunk = Document(page_content="\n\n".join(parts), metadata=metadata)
+            parts, tokens, has_body = [], 0, False
+            return chunk
+
+        for page in pages:
+            for kind, offset, text in iter_blocks(page.page_content):
+                units = [(text, offset, count_tokens(text, self.model))]
+                if kind == "heading":
+                    # Headings open a chunk; consecutive headings share one
+                    if has_body:
+                        yield flush()
+                    heading = text
+                    if parts:
+                        metadata["heading"] = heading
+                elif units[0][2] > self.chunk_tokens:
+                    units = self._pieces(text, offset)
+                for unit, unit_offset, size in units:
+                    if parts and tokens + size > self.chunk_tokens and (has_body or kind != "heading"):
+                        yield flush()
+                    if not parts:
+                        metadata = dict(page.metadata, start_index=unit_offset, heading=heading)
+                    # Sentences of one paragraph stay on one line
+                    if parts and unit_offset != offset:
+                        parts[-1] += " " + unit
+                    else:
+                        parts.append(unit)
+                    tokens += size
+                    has_body = has_body or kind != "heading"
+        if parts:
+            yield flush()
+
+    def _pieces(self, text, offset):
+        """Split an oversized paragraph into sentences, and oversized sentences into word runs"""
+        pieces = []
+        position = 0
+        for sentence in split_sentences(text):
+            start = text.index(sentence, position)
+            position = start + len(sentence)
+            size = count_tokens(sentence, self.model)
+            if size <= self.chunk_tokens:
+                pieces.append((sentence, offset + start, size))
+                continue
+            words = []
+            run_start = run_tokens = 0
+            for match in re.finditer(r"\S+", sentence):
+                word_tokens = count_tokens(" " + match.group(), self.model)
+                if words and run_tokens + word_tokens > self.chunk_tokens:
+                    pieces.append((" ".join(words), offset + start + run_start, run_tokens))
+                    words, run_tokens = [], 0
+                if not words:
+                    run_start = match.start()
+                words.append(match.group())
+                run_tokens += word_tokens
+            if words:
+                pieces.append((" ".join(words), offset + start + run_start, run_tokens))
+        return pieces
@@ -0,0 +1,98 @@
+from typing import List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from utils.tokens import count_tokens, truncate_tokens
+
+# Overlaps shorter than this are treated as coincidence, not splitter overlap
+MIN_OVERLAP_CHARS = 20
+
+
+def overlap_length(left, right, max_overlap):
+    """Length of the longest suffix of ``left`` (up to ``max_overlap`` chars) that starts ``right``"""
+    probe = right[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+    # The first match is the longest overlap
+    pos = left.find(probe, max(0, len(left) - max_overlap))
+    while pos != -1:
+        if right.startswith(left[pos:]):
+            return len(left) - pos
+        pos = left.find(probe, pos + 1)
+    return 0
+
+
+def _same_section(a, b):
+    return a.metadata.get("source") == b.metadata.get("source") and a.metadata.get("page") == b.metadata.get("page")
+
+
+def remove_overlaps(documents, max_overlap):
+    """Drop the text each chunk repeats from the end of the chunk before it.
+
+    ``documents`` must be in reading order, as produced by the splitter.
+    """
+    result = []
+    previous = None
+    for doc in documents:
+        text = doc.page_content
+        if previous is not None and _same_section(previous, doc):
+            text = text[overlap_length(previous.page_content, text, max_overlap):]
+        previous = doc
+        if text.strip():
+            result.append(Document(page_content=text, metadata=doc.metadata))
+    return result
+
+
+def pack_context(documents, max_tokens, max_overlap, model=None):
+    """Pick chunks in priority order until ``max_tokens`` is used up.
+
+    ``documents`` are ordered most valuable first (e.g. retriever order).
+    Exact duplicates are skipped, and text a chunk shares with an already
+    picked neighbour from the same page (the splitter's overlap) is trimmed
+    before its tokens are counted. The first chunk is truncated if it alone is
+    over budget; later chunks that don't fit are skipped so smaller ones
+    further down can still fill the budget.
+    """
+    packed = []
+    seen = set()
+    used = 0
+    for doc in documents:
+        text = doc.page_content
+        if text in seen:
+            continue
+        seen.add(text)
+        for chosen in packed:
+            if _same_section(chosen, doc):
+                text = text[overlap_length(chosen.page_content, text, max_overlap):]
+                cut = overlap_length(text, chosen.page_content, max_overlap)
+                if cut:
+                    text = text[:-cut]
+        if not text.strip():
+            continue
+
+        tokens = count_tokens(text, model)
+        if used + tokens > max_tokens:
+            if packed:
+                continue
+            text = truncate_tokens(text, max_tokens, model)
+            tokens = max_tokens
+        packed.append(Document(page_content=text, metadata=doc.metadata))
+        used += tokens
+        if used >= max_tokens:
+            break
+    return packed
+
+
+class PackedRetriever(BaseRetriever):
+    """Wraps a retriever and packs its results into a token budget with ``pack_context``"""
+
+    retriever: BaseRetriever
+    max_tokens: int = 2500
+    max_overlap: int = 200
+    model: str = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        documents = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return pack_context(documents, self.max_tokens, self.max_overlap, self.model)
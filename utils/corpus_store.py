@@ -0,0 +1,245 @@
+import os
+import threading
+import time
+import weakref
+
+import faiss
+import numpy as np
+
+from utils.ann_index import index_mode
+from utils.embedding_backends import get_embeddings
+from utils.index_manager import IndexManager
+from utils.index_store import IndexStore
+from utils.ingest_cache import embedding_settings, make_key
+from utils.jobs import get_job_queue
+from utils.resources import resource
+
+# Files nobody references stay indexed this long, so a reload or a returning student reuses them
+EVICT_GRACE_SECONDS = int(os.environ.get("STUDY_BUDDY_EVICT_GRACE_SECONDS", 600))
+# Views holding at most this share of the corpus are searched exactly over their own vectors
+EXACT_SEARCH_SHARE = float(os.environ.get("STUDY_BUDDY_EXACT_SEARCH_SHARE", 0.05))
+
+
+class CorpusStore:
+    """Process-wide, content-addressed index shared by every session.
+
+    Files are keyed by their SHA-256, so a document uploaded by many sessions
+    is embedded and stored once in the shared ``IndexManager``. Each session
+    searches through a :class:`CorpusView` of the files it uploaded. Views
+    count references to their files; a file no view references is removed
+    once it has been unused for ``grace`` seconds, by an eviction job started
+    whenever a view is opened.
+
+    Ingestion jobs write to ``self.manager`` while holding its
+    ``ingest_lock``, and only add files (see ``stream_ingest(prune=False)``);
+    eviction is the only way files leave the store. Both save the corpus
+    through ``index_store`` when they change it, and :func:`get_corpus_store`
+    starts from that save, whose files then get the usual grace period to be
+    claimed by a view.
+    """
+
+    def __init__(self, embeddings, grace=EVICT_GRACE_SECONDS, manager=None, index_store=None):
+        self.manager = manager or IndexManager(embeddings)
+        self.index_store = index_store
+        self.grace = grace
+        self._refs = {}
+        # File hash -> when its last view let go of it
+        self._idle = {}
+        # Reentrant: a view collected during an eviction releases from inside it
+        self._lock = threading.RLock()
+
+    @property
+    def embeddings(self):
+        return self.manager.embeddings
+
+    def view(self, file_hashes):
+        """A view of ``file_hashes`` holding a reference to each until it is closed or collected"""
+        file_hashes = list(dict.fromkeys(file_hashes))
+        with self._lock:
+            for file_hash in file_hashes:
+                self._refs[file_hash] = self._refs.get(file_hash, 0) + 1
+                self._idle.pop(file_hash, None)
+        view = CorpusView(self, file_hashes)
+        # Sessions that just go away never close their view
+        view._finalizer = weakref.finalize(view, self.release, file_hashes)
+        self.schedule_evict()
+        return view
+
+    def release(self, file_hashes):
+        """Drop one reference to each of ``file_hashes``"""
+        now = time.time()
+        with self._lock:
+            for file_hash in file_hashes:
+                refs = self._refs.get(file_hash, 0) - 1
+                if refs > 0:
+                    self._refs[file_hash] = refs
+                else:
+                    self._refs.pop(file_hash, None)
+                    self._idle[file_hash] = now
+
+    def refs(self, file_hash):
+        """Number of open views that include ``file_hash``"""
+        return self._refs.get(file_hash, 0)
+
+    def schedule_evict(self):
+        """Run :meth:`evict` as a background job, so no session waits on an index rebuild"""
+        key = make_key("evict", embedding_settings(self.embeddings))
+        # Joins an eviction that is already running
+        return get_job_queue().submit(key, self._evict_job, kind="evict", force=True)
+
+    def _evict_job(self, job):
+        return self.evict()
+
+    def evict(self, grace=None):
+        """Remove files that no view has referenced for ``grace`` seconds; returns their hashes"""
+        grace = self.grace if grace is None else grace
+        cutoff = time.time() - grace
+        # Never wait on an ingestion job; what is left over goes next time
+        if not self.manager.ingest_lock.acquire(blocking=False):
+            return []
+        try:
+            # Held through the removal, so a view opened meanwhile waits and then
+            # finds its files either still indexed or gone (and ingests them again)
+            with self._lock:
+                # Files can also arrive unreferenced, from an ingestion its session gave up on
+                for file_hash in list(self.manager.file_ids):
+                    if file_hash not in self._refs and file_hash not in self._idle:
+                        self._idle[file_hash] = time.time()
+                expired = [h for h, since in self._idle.items() if since <= cutoff]
+                for file_hash in expired:
+                    del self._idle[file_hash]
+                # One pass, so evicting many files costs at most one index rebuild
+                self.manager.remove_files(expired)
+            if expired:
+                self.save()
+            return expired
+        finally:
+            self.manager.ingest_lock.release()
+
+    def save(self):
+        """Write the corpus to ``index_store``, if there is one; the caller holds ``ingest_lock``"""
+        if self.index_store is not None:
+            self.index_store.save(self.manager)
+
+
+class CorpusView:
+    """One session's window onto a :class:`CorpusStore`.
+
+    Offers the parts of the ``IndexManager`` interface the app and
+    ``HybridRetriever`` use, limited to the view's files: vector and keyword
+    searches only return chunks of those files, filtered inside FAISS and
+    BM25 by a bitmap of their ids that is rebuilt when the index changes.
+    Views that hold a small share of the corpus are searched exactly over
+    their own vectors instead (see EXACT_SEARCH_SHARE).
+    """
+
+    def __init__(self, store, file_hashes):
+        self.store = store
+        self.file_hashes = list(file_hashes)
+        self._mask = None
+        self._mask_version = None
+        self._exact = None
+        self._finalizer = None
+
+    @property
+    def manager(self):
+        return self.store.manager
+
+    @property
+    def embeddings(self):
+        return self.store.embeddings
+
+    @property
+    def lock(self):
+        return self.manager.lock
+
+    @property
+    def files(self):
+        """The view's files that are completely indexed"""
+        return set(self.file_hashes) & self.manager.files
+
+    @property
+    def vectorstore(self):
+        """The shared vector store once any of the view's chunks are in it, else None"""
+        manager = self.manager
+        if manager.vectorstore is None or not any(manager.file_ids.get(h) for h in self.file_hashes):
+            return None
+        return manager.vectorstore
+
+    def close(self):
+        """Release the view's references"""
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def _allowed(self):
+        """Boolean mask over chunk ids, the FAISS bitmap selector built from it and the ids it holds"""
+        manager = self.manager
+        with manager.lock:
+            if self._mask_version != manager.version:
+                ids = np.asarray([i for h in self.file_hashes for i in manager.file_ids.get(h, [])], dtype="int64")
+                mask = np.zeros(manager._next_id, dtype=bool)
+                mask[ids] = True
+                bitmap = np.packbits(mask, bitorder="little")
+                # The selector takes the bitmap's length in bytes and points into it,
+                # so ``bitmap`` is kept alive alongside it
+                self._mask = (mask, bitmap, faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap)), ids)
+                self._mask_version = manager.version
+                self._exact = None
+            return self._mask
+
+    def _exact_index(self, index, ids):
+        """Flat index over the view's own vectors, rebuilt with the mask; the caller holds ``lock``"""
+        if self._exact is None:
+            exact = faiss.IndexFlat(index.d, index.metric_type)
+            exact.add(index.reconstruct_batch(ids))
+            self._exact = exact
+        return self._exact
+
+    def search(self, vector, k):
+        """Ids of the ``k`` chunks of the view's files nearest to ``vector``"""
+        with self.lock:
+            _, _, selector, ids = self._allowed()
+            if not len(ids):
+                return []
+            index = self.manager.vectorstore.index
+            if len(ids) <= EXACT_SEARCH_SHARE * index.ntotal:
+                # Filtering a small view out of the whole graph or a few lists finds
+                # few of its chunks, and scanning the view itself is cheap
+                _, found = self._exact_index(index, ids).search(vector, k)
+                return [int(ids[i]) for i in found[0] if i >= 0]
+            # Only one in ``ratio`` candidates passes the selector, so look that much wider
+            ratio = index.ntotal / len(ids)
+            mode = index_mode(index)
+            if mode == "hnsw":
+                params = faiss.SearchParametersHNSW()
+                ef_search = faiss.downcast_index(faiss.downcast_index(index).index).hnsw.efSearch
+                params.efSearch = min(int(ef_search * ratio), index.ntotal)
+            elif mode.startswith("ivf"):
+                ivf = faiss.extract_index_ivf(index)
+                params = faiss.SearchParametersIVF()
+                params.nprobe = min(int(ivf.nprobe * ratio), ivf.nlist)
+            else:
+                params = faiss.SearchParameters()
+            params.sel = selector
+            _, found = index.search(vector, k, params=params)
+        return [int(i) for i in found[0] if i >= 0]
+
+    def keyword_search(self, query, k):
+        """Ids of the ``k`` best BM25 matches for ``query`` among the view's files"""
+        mask, _, _, _ = self._allowed()
+        return [i for i, _ in self.manager.keywords.search(query, k, mask=mask)]
+
+    def documents(self, file_hashes=None):
+        """Chunks of the view's files in file order"""
+        return self.manager.documents(self.file_hashes if file_hashes is None else file_hashes)
+
+    def documents_by_id(self, ids):
+        return self.manager.documents_by_id(ids)
+
+
+@resource
+def get_corpus_store(backend):
+    """The shared corpus for one embedding backend ("openai" or "local"), as it was last saved"""
+    embeddings = get_embeddings(backend)
+    index_store = IndexStore()
+    return CorpusStore(embeddings, manager=index_store.load(embeddings), index_store=index_store)
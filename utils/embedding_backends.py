@@ -0,0 +1,91 @@
+import atexit
+import os
+
+from langchain_core.embeddings import Embeddings
+
+from utils.embedding_client import BatchedEmbeddings
+from utils.resources import get_sentence_transformer, resource
+
+# "openai" or "local"
+EMBEDDING_BACKEND = os.environ.get("STUDY_BUDDY_EMBEDDING_BACKEND", "openai")
+LOCAL_MODEL = os.environ.get("STUDY_BUDDY_LOCAL_MODEL", "all-MiniLM-L6-v2")
+LOCAL_BATCH_SIZE = int(os.environ.get("STUDY_BUDDY_LOCAL_BATCH_SIZE", 64))
+# Encoding processes for large inputs; 1 encodes in the calling process
+LOCAL_PROCESSES = int(os.environ.get("STUDY_BUDDY_LOCAL_PROCESSES", 1))
+# "torch", "onnx" or "openvino" (the last two need sentence-transformers>=3.2)
+LOCAL_RUNTIME = os.environ.get("STUDY_BUDDY_LOCAL_RUNTIME", "torch")
+LOCAL_INT8 = os.environ.get("STUDY_BUDDY_LOCAL_INT8", "0") == "1"
+
+# Below this many texts a multi-process pool costs more than it saves
+MULTI_PROCESS_MIN_TEXTS = 256
+
+
+class LocalEmbeddings(Embeddings):
+    """CPU sentence-transformers embeddings behind the LangChain ``Embeddings`` interface.
+
+    Texts are encoded in batches of ``batch_size``. With ``processes > 1``
+    large inputs are spread over a sentence-transformers multi-process pool.
+    ``runtime="onnx"`` uses the ONNX Runtime backend, and ``int8=True``
+    quantizes the model to int8 (dynamic quantization for torch, the
+    pre-quantized ONNX weights for onnx). The model is loaded on first use and
+    shared with every other user of the same model in the process.
+    """
+
+    def __init__(self, model=LOCAL_MODEL, batch_size=LOCAL_BATCH_SIZE, processes=LOCAL_PROCESSES,
+                 runtime=LOCAL_RUNTIME, int8=LOCAL_INT8, device="cpu"):
+        self.model = model
+        self.batch_size = batch_size
+        self.processes = processes
+        self.runtime = runtime
+        self.int8 = int8
+        self.device = device
+        # Quantization and runtime change the vectors slightly, so they are part of cache keys
+        self.variant = f"{runtime}-int8" if int8 else runtime
+        self._model = None
+        self._pool = None
+
+    def _load(self):
+        if self._model is None:
+            self._model = get_sentence_transformer(self.model, self.device, self.runtime, self.int8)
+        return self._model
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = self._load().start_multi_process_pool(target_devices=[self.device] * self.processes)
+            atexit.register(self.close)
+        return self._pool
+
+    def close(self):
+        """Stop the multi-process pool, if one was started"""
+        if self._pool is not None:
+            from sentence_transformers import SentenceTransformer
+            SentenceTransformer.stop_multi_process_pool(self._pool)
+            self._pool = None
+
+    def encode(self, texts):
+        """Encode ``texts`` into a float32 NumPy matrix"""
+        model = self._load()
+        if self.processes > 1 and len(texts) >= MULTI_PROCESS_MIN_TEXTS:
+            pool = self._get_pool()
+            if hasattr(model, "encode_multi_process"):
+                return model.encode_multi_process(texts, pool, batch_size=self.batch_size)
+            return model.encode(texts, pool=pool, batch_size=self.batch_size)
+        return model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True, show_progress_bar=False)
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        return self.encode(list(texts)).tolist()
+
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
+
+
+@resource
+def get_embeddings(backend=EMBEDDING_BACKEND):
+    """Embeddings for ``backend``: "openai" (remote API) or "local" (sentence-transformers on CPU)"""
+    if backend == "local":
+        return LocalEmbeddings()
+    if backend == "openai":
+        return BatchedEmbeddings()
+    raise ValueError(f"Unknown embedding backend: {backend}")
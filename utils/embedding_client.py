@@ -0,0 +1,238 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+
+import openai
+from langchain_core.embeddings import Embeddings
+
+from utils.tokens import count_tokens
+
+EMBEDDING_MODEL = os.environ.get("STUDY_BUDDY_EMBEDDING_MODEL", "text-embedding-ada-002")
+# Point this at a local server to run without the OpenAI API
+EMBEDDING_BASE_URL = os.environ.get("STUDY_BUDDY_EMBEDDING_BASE_URL") or None
+# Per-request limits; the API allows at most 2048 inputs per request
+MAX_BATCH_TOKENS = int(os.environ.get("STUDY_BUDDY_EMBED_BATCH_TOKENS", 60000))
+MAX_BATCH_SIZE = int(os.environ.get("STUDY_BUDDY_EMBED_BATCH_SIZE_LIMIT", 512))
+# Requests in flight at once, before any rate-limit throttling
+MAX_CONCURRENCY = int(os.environ.get("STUDY_BUDDY_EMBED_CONCURRENCY", 4))
+MAX_RETRIES = 6
+
+
+def pack_batches(texts, max_tokens=MAX_BATCH_TOKENS, max_size=MAX_BATCH_SIZE, model=None):
+    """Group text indices into batches that stay under a token and size budget.
+
+    Returns ``(batches, total_tokens)`` where each batch is a list of indices
+    into ``texts``. A single text larger than ``max_tokens`` gets a batch of
+    its own.
+    """
+    batches = []
+    batch = []
+    batch_tokens = 0
+    total_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text, model)
+        total_tokens += tokens
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_size):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches, total_tokens
+
+
+class _AdaptiveLimiter:
+    """Concurrency limit that halves on rate limiting and creeps back up on success"""
+
+    def __init__(self, limit):
+        self.max_limit = limit
+        self.limit = limit
+        self.active = 0
+        self._successes = 0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def __aexit__(self, *exc):
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def throttle(self):
+        self.limit = max(1, self.limit // 2)
+        self._successes = 0
+
+    async def recover(self):
+        self._successes += 1
+        if self.limit < self.max_limit and self._successes >= self.limit:
+            self.limit += 1
+            self._successes = 0
+            async with self._cond:
+                self._cond.notify_all()
+
+
+class BatchedEmbeddings(Embeddings):
+    """OpenAI-compatible embedding client that sends token-budgeted batches concurrently.
+
+    Texts are packed into batches of at most ``max_batch_tokens`` tokens and up
+    to ``max_concurrency`` batches are in flight at once. On HTTP 429 the
+    client waits (honouring ``Retry-After``) and halves its concurrency, then
+    ramps back up as requests succeed. ``base_url`` can point at any server
+    that speaks the ``/v1/embeddings`` API, such as
+    ``utils.fake_embedding_server`` for testing.
+
+    The HTTP client and the concurrency limit are kept per event loop, so
+    connections are reused and a rate-limit backoff carries over from one
+    call to the next. The sync methods all run on one event loop in a
+    background thread for that reason.
+
+    Running totals are kept in ``stats``; see :meth:`throughput`.
+    """
+
+    def __init__(self, model=EMBEDDING_MODEL, base_url=EMBEDDING_BASE_URL, api_key=None,
+                 max_batch_tokens=MAX_BATCH_TOKENS, max_batch_size=MAX_BATCH_SIZE,
+                 max_concurrency=MAX_CONCURRENCY, max_retries=MAX_RETRIES, timeout=60):
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._stats_lock = threading.Lock()
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        # Event loop -> (client, limiter); async clients can't be shared across loops
+        self._sessions = weakref.WeakKeyDictionary()
+        self.stats = {"requests": 0, "texts": 0, "tokens": 0, "rate_limited": 0, "retries": 0, "seconds": 0.0}
+
+    def throughput(self):
+        """Texts and tokens embedded per second of wall-clock embedding time"""
+        seconds = self.stats["seconds"] or 1e-9
+        return {"texts_per_s": self.stats["texts"] / seconds, "tokens_per_s": self.stats["tokens"] / seconds}
+
+    def _client(self):
+        # Retries are handled here so rate limits can also shrink concurrency
+        return openai.AsyncOpenAI(
+            api_key=self.api_key or os.environ.get("OPENAI_API_KEY") or "unused",
+            base_url=self.base_url,
+            max_retries=0,
+            timeout=self.timeout,
+        )
+
+    def _session(self):
+        """``(client, limiter)`` of the running event loop, created on its first call"""
+        loop = asyncio.get_running_loop()
+        with self._loop_lock:
+            session = self._sessions.get(loop)
+            if session is None:
+                session = self._sessions[loop] = (self._client(), _AdaptiveLimiter(self.max_concurrency))
+        return session
+
+    def _event_loop(self):
+        """Loop the sync methods run on, in a daemon thread started on first use"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="study-buddy-embeddings", daemon=True).start()
+            return self._loop
+
+    async def _embed_batch(self, client, limiter, texts):
+        for attempt in range(self.max_retries + 1):
+            async with limiter:
+                try:
+                    response = await client.embeddings.create(model=self.model, input=texts)
+                except openai.RateLimitError as e:
+                    error = e
+                    limiter.throttle()
+                    with self._stats_lock:
+                        self.stats["rate_limited"] += 1
+                except (openai.APIConnectionError, openai.InternalServerError) as e:
+                    error = e
+                else:
+                    await limiter.recover()
+                    with self._stats_lock:
+                        self.stats["requests"] += 1
+                    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+            if attempt == self.max_retries:
+                raise error
+            with self._stats_lock:
+                self.stats["retries"] += 1
+            retry_after = None
+            response = getattr(error, "response", None)
+            if response is not None:
+                try:
+                    retry_after = float(response.headers.get("retry-after"))
+                except (TypeError, ValueError):
+                    retry_after = None
+            delay = retry_after if retry_after is not None else min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+            await asyncio.sleep(delay)
+
+    async def aembed_documents(self, texts):
+        """Embed ``texts`` concurrently, returning vectors in input order"""
+        if not texts:
+            return []
+        # The API rejects empty strings
+        texts = [text if text else " " for text in texts]
+        batches, total_tokens = pack_batches(texts, self.max_batch_tokens, self.max_batch_size, self.model)
+        started = time.perf_counter()
+        client, limiter = self._session()
+        results = await asyncio.gather(
+            *(self._embed_batch(client, limiter, [texts[i] for i in batch]) for batch in batches)
+        )
+        with self._stats_lock:
+            self.stats["texts"] += len(texts)
+            self.stats["tokens"] += total_tokens
+            self.stats["seconds"] += time.perf_counter() - started
+
+        vectors = [None] * len(texts)
+        for batch, batch_vectors in zip(batches, results):
+            for i, vector in zip(batch, batch_vectors):
+                vectors[i] = vector
+        return vectors
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+    def embed_documents(self, texts):
+        return asyncio.run_coroutine_threadsafe(self.aembed_documents(texts), self._event_loop()).result()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from utils.fake_embedding_server import FakeEmbeddingServer, fake_vector
+
+    parser = argparse.ArgumentParser(description="Embedding throughput against a server, or a local fake")
+    parser.add_argument("--base-url", default=EMBEDDING_BASE_URL, help="/v1/embeddings server (a local fake if omitted)")
+    parser.add_argument("--texts", type=int, default=5000, help="number of synthetic texts per call")
+    parser.add_argument("--calls", type=int, default=3, help="calls in a row, sharing connections and backoff")
+    parser.add_argument("--rate-limit", type=float, default=0.2, help="share of requests the fake answers with 429")
+    args = parser.parse_args()
+    server = None
+    if args.base_url is None:
+        server = FakeEmbeddingServer(rate_limit=args.rate_limit).start()
+        args.base_url = server.url
+    embeddings = BatchedEmbeddings(base_url=args.base_url)
+    texts = [f"Chunk {i}: " + "study notes " * (i % 50) for i in range(args.texts)]
+    for call in range(args.calls):
+        vectors = embeddings.embed_documents(texts)
+        if server is not None:
+            assert all(v == fake_vector(t) for v, t in zip(vectors[:100], texts)), "vectors out of order"
+        print(f"call {call + 1}: {embeddings.stats}")
+    print({k: round(v, 1) for k, v in embeddings.throughput().items()})
+    if server is not None:
+        server.stop()
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+FAKE_DIMENSION = 8
+
+
+def fake_vector(text, dimension=FAKE_DIMENSION):
+    """The unit vector the fake server returns for ``text``"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body, headers=()):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        with server.lock:
+            server.requests += 1
+            limited = random.random() < server.rate_limit or (
+                server.max_in_flight is not None and server.in_flight >= server.max_in_flight)
+            if limited:
+                server.rate_limited += 1
+            else:
+                server.in_flight += 1
+        if limited:
+            self._reply(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                        [("Retry-After", str(server.retry_after))])
+            return
+        try:
+            if server.latency:
+                time.sleep(server.latency)
+            data = [{"object": "embedding", "index": i, "embedding": fake_vector(text, server.dimension)}
+                    for i, text in enumerate(texts)]
+            # Out of order on purpose; clients must sort by index
+            data.reverse()
+            usage = {"prompt_tokens": len(texts), "total_tokens": len(texts)}
+            self._reply(200, {"object": "list", "data": data, "model": body.get("model"), "usage": usage})
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+class FakeEmbeddingServer(ThreadingHTTPServer):
+    """Local stand-in for the OpenAI ``/v1/embeddings`` API, for exercising ``BatchedEmbeddings``.
+
+    Every text gets a deterministic vector (see :func:`fake_vector`), so
+    results can be checked. ``rate_limit`` is the share of requests answered
+    with HTTP 429 and ``Retry-After``, ``max_in_flight`` rejects requests
+    beyond that many at once the same way, and ``latency`` delays every
+    answer. ``requests`` and ``rate_limited`` count what the server saw.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, dimension=FAKE_DIMENSION, rate_limit=0.0,
+                 max_in_flight=None, latency=0.0, retry_after=0.05):
+        super().__init__((host, port), _Handler)
+        self.dimension = dimension
+        self.rate_limit = rate_limit
+        self.max_in_flight = max_in_flight
+        self.latency = latency
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.in_flight = 0
+
+    @property
+    def url(self):
+        """Base URL to pass to ``BatchedEmbeddings``"""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        """Serve on a daemon thread; returns the server"""
+        threading.Thread(target=self.serve_forever, name="fake-embedding-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve fake /v1/embeddings for STUDY_BUDDY_EMBEDDING_BASE_URL")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dimension", type=int, default=FAKE_DIMENSION)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="429 beyond this many requests at once")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before every answer")
+    args = parser.parse_args()
+    server = FakeEmbeddingServer(port=args.port, dimension=args.dimension, rate_limit=args.rate_limit,
+                                 max_in_flight=args.max_in_flight, latency=args.latency)
+    print(f"Serving fake embeddings at {server.url}")
+    server.serve_forever()
@@ -0,0 +1,55 @@
+from typing import Any, List
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+# Rank offset from the reciprocal rank fusion paper; damps the weight of the top few ranks
+RRF_K = 60
+# Run metadata key for ``{query: vector}`` a caller has already embedded (e.g. for the answer cache)
+QUERY_VECTORS_KEY = "query_vectors"
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Merge ranked lists of ids, scoring each id by the sum of ``1 / (k + rank)``"""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """Fuses FAISS and BM25 results of an ``IndexManager`` with reciprocal rank fusion.
+
+    ``manager`` can also be a ``CorpusView``, which limits both searches to
+    one session's files of the shared corpus.
+
+    Dense search finds paraphrases, keyword search finds exact terms (formula
+    names, acronyms, section numbers); each contributes ``fetch_k`` candidates
+    and the best ``k`` fused chunks are returned. The manager is read on every
+    query (under its lock), so chunks indexed after the retriever was built
+    are searchable. A query vector passed in the run metadata under
+    QUERY_VECTORS_KEY is used instead of embedding the query again.
+    """
+
+    manager: Any
+    k: int = 8
+    fetch_k: int = 20
+    rrf_k: int = RRF_K
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        manager = self.manager
+        if manager.vectorstore is None:
+            return []
+        vector = run_manager.metadata.get(QUERY_VECTORS_KEY, {}).get(query)
+        if vector is None:
+            vector = manager.embeddings.embed_query(query)
+        vector = np.asarray([vector], dtype="float32")
+        # Ingestion may be adding to the index on a worker thread
+        with manager.lock:
+            dense = manager.search(vector, self.fetch_k)
+            sparse = manager.keyword_search(query, self.fetch_k)
+            fused = reciprocal_rank_fusion([dense, sparse], self.rrf_k)[:self.k]
+            return manager.documents_by_id(fused)
@@ -0,0 +1,306 @@
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+from utils.ann_index import (INDEX_MODE, INDEX_MODES, build_index, choose_codec, choose_mode, index_codec,
+                             index_mode, make_index, supports_removal, train_index)
+from utils.bm25 import BM25Index
+from utils.chunk_store import ChunkIds, ChunkStore
+
+INDEX_FILE = "index.faiss"
+META_FILE = "index.pkl"
+CHUNKS_FILE = "chunks.bin"
+
+
+class IndexManager:
+    """Incrementally maintained FAISS index, grouped by source file.
+
+    Vectors live in an ``IndexIDMap2`` so every chunk keeps a stable integer id.
+    Adding a file only embeds and inserts that file's chunks, and removing a
+    file deletes exactly its ids, so the cost of an update follows the size of
+    the change rather than the size of the corpus.
+
+    Chunk texts and metadata live in ``self.chunks``, a memory-mapped
+    ``ChunkStore`` whose record ids are the vector ids, so no per-chunk
+    Documents or id mappings are kept in memory. The LangChain ``FAISS``
+    wrapper in ``self.vectorstore`` shares the same index and chunk store, so
+    retrievers built from it see updates without being rebuilt.
+    ``self.keywords`` is a BM25 index over the same chunks and ids, kept in
+    step as chunks are added and removed.
+
+    New indexes start out flat; :meth:`optimize` moves a grown corpus to an
+    approximate HNSW or IVF index (see ``utils.ann_index``, which also picks
+    how compactly vectors are stored).
+
+    Ingestion runs on a worker thread while the chat searches, so writes and
+    reads go through ``self.lock``. ``self.ingest_lock`` is held by whichever
+    job is changing the set of indexed files; only one does at a time, which
+    lets index rebuilds run outside ``self.lock`` without missing a write.
+    """
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.vectorstore = None
+        self.chunks = ChunkStore()
+        self.keywords = BM25Index()
+        self.file_ids = {}
+        # Files whose chunks are still being streamed in
+        self.partial = set()
+        self._next_id = 0
+        # Set when the index was loaded read-only from a memory-mapped file
+        self._mmap_path = None
+        self.lock = threading.RLock()
+        self.ingest_lock = threading.Lock()
+        # Bumped whenever chunks are added or removed, so readers can tell when derived state is stale
+        self.version = 0
+
+    @property
+    def files(self):
+        """Hashes of the files that are completely indexed"""
+        return set(self.file_ids) - self.partial
+
+    def _ensure_store(self, dimension):
+        if self.vectorstore is None:
+            index = make_index(dimension, "flat", 0, choose_codec(0))
+            self.vectorstore = FAISS(self.embeddings, index, self.chunks, ChunkIds(self.chunks))
+        elif self._mmap_path is not None:
+            # A memory-mapped index is read-only, so pull it into RAM before the first write
+            self.vectorstore.index = faiss.read_index(self._mmap_path)
+            self._mmap_path = None
+        return self.vectorstore
+
+    def add_file(self, file_hash, docs, vectors):
+        """Insert one file's chunks and their precomputed vectors"""
+        if file_hash in self.file_ids:
+            return
+        self.append(file_hash, docs, vectors)
+        self.finish_file(file_hash)
+
+    def append(self, file_hash, docs, vectors):
+        """Add a batch of chunks to a file that is still being indexed.
+
+        The file counts as partial, and is left out of :attr:`files`, until
+        :meth:`finish_file` is called.
+        """
+        if file_hash not in self.file_ids:
+            self.file_ids[file_hash] = []
+            self.partial.add(file_hash)
+        if not docs:
+            return
+        matrix = np.asarray(vectors, dtype="float32")
+        with self.lock:
+            store = self._ensure_store(matrix.shape[1])
+            # Only an int8 index started empty (INT8_MIN_VECTORS=0) is still untrained
+            train_index(store.index, matrix)
+            ids = list(self.chunks.extend(docs))
+            self._next_id = len(self.chunks)
+            store.index.add_with_ids(matrix, np.asarray(ids, dtype="int64"))
+            self.keywords.add_many(ids, [doc.page_content for doc in docs])
+            self.file_ids[file_hash].extend(ids)
+            self.version += 1
+
+    def finish_file(self, file_hash):
+        """Mark a file added with :meth:`append` as completely indexed"""
+        self.partial.discard(file_hash)
+
+    def remove_files(self, file_hashes):
+        """Delete every chunk of ``file_hashes`` in one pass.
+
+        Flat and IVF indexes drop the ids in place. HNSW graphs can't delete
+        nodes, so the index is rebuilt once from the vectors that remain. Once
+        removed chunks outnumber live ones, the remaining chunks are instead
+        renumbered into a fresh chunk store, keyword index and vector index,
+        so evicted text doesn't pile up in the chunk file. Rebuilds run
+        outside ``self.lock`` (the caller holds ``ingest_lock``, so nothing is
+        added meanwhile) and searches carry on against the old state until
+        the new one is swapped in.
+        """
+        with self.lock:
+            file_hashes = [h for h in dict.fromkeys(file_hashes) if h in self.file_ids]
+            ids = [i for h in file_hashes for i in self.file_ids[h]]
+            index = self.vectorstore.index if ids else None
+            removed = set(file_hashes)
+            keep = [i for h, file_ids in self.file_ids.items() if h not in removed for i in file_ids]
+            compact = index is not None and len(self.chunks) - len(keep) > len(keep)
+            rebuild = compact or (index is not None and not supports_removal(index))
+            if rebuild:
+                snapshot = self._snapshot(keep)
+        if compact:
+            renumbered = self._compacted(keep, snapshot, index)
+        new_index = self._build(*snapshot, index_mode(index), index) if rebuild and not compact else None
+        with self.lock:
+            for file_hash in file_hashes:
+                del self.file_ids[file_hash]
+                self.partial.discard(file_hash)
+            if not ids:
+                return
+            store = self._ensure_store(None)
+            if compact:
+                self._swap(*renumbered)
+            elif new_index is not None:
+                store.index = new_index
+            else:
+                store.index.remove_ids(np.asarray(ids, dtype="int64"))
+            if not compact:
+                self.chunks.delete(ids)
+                self.keywords.remove(ids)
+            self.version += 1
+
+    def _compacted(self, keep, snapshot, index):
+        """Chunk store, keyword index, vector index and id map with ``keep`` renumbered from 0"""
+        dimension, _, vectors = snapshot
+        new_ids = np.arange(len(keep), dtype="int64")
+        chunks = self.chunks.copy(keep)
+        keywords = BM25Index()
+        keywords.add_many(range(len(keep)), (chunks.text(i) for i in range(len(keep))))
+        new_index = self._build(dimension, new_ids, vectors, index_mode(index), index)
+        return chunks, keywords, new_index, dict(zip(keep, range(len(keep))))
+
+    def _swap(self, chunks, keywords, index, renumber):
+        # Chunk handles already given out keep the old store (and its file) alive until they go
+        self.chunks = chunks
+        self.keywords = keywords
+        self.vectorstore = FAISS(self.embeddings, index, chunks, ChunkIds(chunks))
+        self.file_ids = {h: [renumber[i] for i in file_ids] for h, file_ids in self.file_ids.items()}
+        self._next_id = len(chunks)
+
+    def _snapshot(self, ids):
+        """``(dimension, ids, vectors)`` of the chunks ``ids``, for :meth:`_build`"""
+        index = self._ensure_store(None).index
+        ids = np.asarray(ids, dtype="int64")
+        return index.d, ids, index.reconstruct_batch(ids) if len(ids) else None
+
+    @staticmethod
+    def _build(dimension, ids, vectors, mode, like):
+        if not len(ids):
+            return make_index(dimension, "flat", 0, choose_codec(0))
+        return build_index(vectors, mode, ids, choose_codec(len(ids)), like=like)
+
+    def optimize(self, mode=INDEX_MODE):
+        """Rebuild the vector index in the mode that suits the corpus size.
+
+        With "auto" the index only ever moves up INDEX_MODES as the corpus
+        grows, so a corpus hovering around a threshold is not rebuilt back and
+        forth. A float16 index is also rebuilt once the corpus is large enough
+        to learn int8 ranges from (see ``choose_codec``). Vectors are taken
+        from the current index, which is lossy once it is IVF-PQ. Returns True
+        if the index was rebuilt.
+        """
+        if self.vectorstore is None:
+            return False
+        index = self.vectorstore.index
+        current = index_mode(index)
+        target = choose_mode(index.ntotal, mode)
+        if mode == "auto" and INDEX_MODES.index(target) < INDEX_MODES.index(current):
+            target = current
+        if target == current and (target == "ivf_pq" or index_codec(index) == choose_codec(index.ntotal)):
+            return False
+        with self.lock:
+            snapshot = self._snapshot([i for file_ids in self.file_ids.values() for i in file_ids])
+        new_index = self._build(*snapshot, target, index)
+        with self.lock:
+            self.vectorstore.index = new_index
+        return True
+
+    def prune(self, wanted):
+        """Remove files that are not in ``wanted`` and files left half-indexed"""
+        wanted_set = set(wanted)
+        removed = [h for h in self.file_ids if h not in wanted_set or h in self.partial]
+        self.remove_files(removed)
+        return removed
+
+    def documents(self, file_hashes=None):
+        """Indexed chunks in file order (optionally limited to ``file_hashes``).
+
+        The chunks are ``Chunk`` handles that read their text from the chunk
+        store when it is accessed, so holding the list costs almost nothing.
+        """
+        docs = []
+        with self.lock:
+            for file_hash in file_hashes if file_hashes is not None else list(self.file_ids):
+                docs.extend(self.chunks[i] for i in self.file_ids.get(file_hash, []))
+        return docs
+
+    def search(self, vector, k):
+        """Ids of the ``k`` chunks nearest to ``vector`` (a 1 x d float32 array)"""
+        with self.lock:
+            _, ids = self.vectorstore.index.search(vector, k)
+        return [int(i) for i in ids[0] if i >= 0]
+
+    def keyword_search(self, query, k):
+        """Ids of the ``k`` best BM25 matches for ``query``"""
+        return [i for i, _ in self.keywords.search(query, k)]
+
+    def documents_by_id(self, ids):
+        """Chunks for a list of integer ids, in the same order"""
+        return [self.chunks.document(i) for i in ids]
+
+    def save(self, directory):
+        """Write the index, chunks and keyword index to ``directory``, replacing it atomically.
+
+        The caller holds ``ingest_lock``, so nothing changes while it is written.
+        """
+        if self._mmap_path is not None:
+            # Don't keep a mapping of a file that is about to be replaced
+            with self.lock:
+                self._ensure_store(None)
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=parent, prefix=".tmp-index-")
+        try:
+            if self.vectorstore is not None:
+                faiss.write_index(self.vectorstore.index, os.path.join(tmp_dir, INDEX_FILE))
+            meta = {
+                "chunks": self.chunks.save(os.path.join(tmp_dir, CHUNKS_FILE)),
+                "file_ids": self.file_ids,
+                "partial": self.partial,
+                "next_id": self._next_id,
+                "keywords": self.keywords,
+            }
+            with open(os.path.join(tmp_dir, META_FILE), "wb") as f:
+                pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+            if os.path.isdir(directory):
+                shutil.rmtree(directory)
+            os.replace(tmp_dir, directory)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    @classmethod
+    def load(cls, directory, embeddings, mmap=True):
+        """Rebuild a manager saved with :meth:`save`.
+
+        With ``mmap=True`` the vectors are memory-mapped where the installed
+        FAISS supports it, so loading does not read the whole index into RAM.
+        The index is copied into memory the first time it is modified.
+        """
+        with open(os.path.join(directory, META_FILE), "rb") as f:
+            meta = pickle.load(f)
+        manager = cls(embeddings)
+        manager.file_ids = meta["file_ids"]
+        manager.partial = meta.get("partial", set())
+        manager._next_id = meta["next_id"]
+        manager.chunks = ChunkStore.load(os.path.join(directory, CHUNKS_FILE), meta["chunks"])
+
+        index_path = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            index = None
+            if mmap:
+                flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+                try:
+                    index = faiss.read_index(index_path, flags)
+                    manager._mmap_path = index_path
+                except RuntimeError:
+                    index = None
+            if index is None:
+                index = faiss.read_index(index_path)
+            manager.vectorstore = FAISS(embeddings, index, manager.chunks, ChunkIds(manager.chunks))
+
+        manager.keywords = meta["keywords"]
+        return manager
@@ -0,0 +1,55 @@
+import os
+import pickle
+import shutil
+
+from utils.ingest_cache import CACHE_DIR, embedding_settings, make_key
+from utils.index_manager import IndexManager
+
+# Saved indexes live next to the ingestion cache
+INDEX_DIR = os.path.join(CACHE_DIR, "indexes")
+MAX_SAVED_INDEXES = int(os.environ.get("STUDY_BUDDY_MAX_SAVED_INDEXES", 20))
+
+
+class IndexStore:
+    """Saves and reloads the shared corpus index across restarts.
+
+    Each saved index is a directory named after the fingerprint of the
+    embedding model, so a restarted server memory-maps the corpus it had
+    built for that model instead of re-adding every file from the ingestion
+    cache. Only the ``max_indexes`` most recently used directories are kept.
+    """
+
+    def __init__(self, root=INDEX_DIR, max_indexes=MAX_SAVED_INDEXES):
+        self.root = root
+        self.max_indexes = max_indexes
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, embeddings):
+        """Directory holding the corpus embedded with ``embeddings``"""
+        return os.path.join(self.root, make_key("corpus", embedding_settings(embeddings)))
+
+    def load(self, embeddings):
+        """Return the saved manager for this embedding model, or None if there isn't one"""
+        directory = self.path(embeddings)
+        if not os.path.isdir(directory):
+            return None
+        try:
+            manager = IndexManager.load(directory, embeddings)
+        except (OSError, RuntimeError, EOFError, KeyError, pickle.UnpicklingError):
+            return None
+        os.utime(directory)
+        return manager
+
+    def save(self, manager):
+        """Persist ``manager`` and drop old saved indexes"""
+        manager.save(self.path(manager.embeddings))
+        self.prune()
+
+    def prune(self):
+        """Keep only the most recently used saved indexes"""
+        with os.scandir(self.root) as it:
+            dirs = [(entry.stat().st_mtime, entry.path) for entry in it
+                    if entry.is_dir() and not entry.name.startswith(".")]
+        dirs.sort(reverse=True)
+        for _, path in dirs[self.max_indexes:]:
+            shutil.rmtree(path, ignore_errors=True)
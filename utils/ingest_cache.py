@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Default location and size budget for the on-disk ingestion cache
+CACHE_DIR = os.environ.get("STUDY_BUDDY_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".study_buddy_cache"))
+MAX_CACHE_BYTES = int(os.environ.get("STUDY_BUDDY_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+# Stages of the ingestion pipeline that can be cached
+STAGES = ("pages", "chunks", "vectors")
+
+
+def file_sha256(data):
+    """Return the SHA-256 hex digest of an uploaded file's bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(*parts):
+    """Build a cache key from a file hash plus the settings that produced a stage"""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def embedding_settings(embeddings):
+    """Settings of an embeddings object that change the vectors it produces"""
+    settings = {"class": type(embeddings).__name__, "model": getattr(embeddings, "model", None)}
+    if getattr(embeddings, "variant", None):
+        settings["variant"] = embeddings.variant
+    return settings
+
+
+def remove_file(path):
+    """Delete ``path``, ignoring a file that is already gone"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def touch(path):
+    """Mark a cache file as just used; eviction goes by mtime"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+@contextmanager
+def atomic_path(path, suffix=".tmp"):
+    """Temporary file next to ``path`` that replaces it once the block succeeds.
+
+    Readers never see a half-written entry, and a failed write leaves no
+    temporary file behind. ``suffix`` must keep ".tmp" in the name, so
+    :func:`cache_entries` skips files still being written.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=suffix)
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        remove_file(tmp_path)
+        raise
+
+
+def cache_entries(directories, suffix):
+    """``(mtime, size, path)`` of the finished ``suffix`` files in ``directories``, least recently used first"""
+    entries = []
+    for directory in directories:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.endswith(suffix) and ".tmp" not in entry.name:
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+    entries.sort()
+    return entries
+
+
+def evict_lru(directories, suffix, max_bytes, ttl=None):
+    """Delete the least recently used ``suffix`` files until they fit ``max_bytes``.
+
+    With ``ttl``, files unused for longer than that many seconds are deleted
+    as well, whatever the total size.
+    """
+    entries = cache_entries(directories, suffix)
+    total = sum(size for _, size, _ in entries)
+    cutoff = None if ttl is None else time.time() - ttl
+    for mtime, size, path in entries:
+        # Entries are oldest first, so once one is fresh and the rest fit, all of them stay
+        if total <= max_bytes and (cutoff is None or mtime >= cutoff):
+            break
+        remove_file(path)
+        total -= size
+
+
+class IngestCache:
+    """Content-addressed on-disk cache for extracted pages, chunks and embedding vectors.
+
+    Entries are pickled into one file per key under ``<root>/<stage>/``. Reads
+    touch the file's mtime so the oldest mtime is the least recently used entry,
+    which is what gets evicted once the cache grows past ``max_bytes``.
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        for stage in STAGES:
+            os.makedirs(os.path.join(root, stage), exist_ok=True)
+
+    def _path(self, stage, key):
+        if stage not in STAGES:
+            raise ValueError(f"Unknown cache stage: {stage}")
+        return os.path.join(self.root, stage, key + ".pkl")
+
+    def get(self, stage, key):
+        """Return the cached value for ``key`` or None on a miss"""
+        path = self._path(stage, key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            # Corrupt or incompatible entry - drop it and treat as a miss
+            remove_file(path)
+            return None
+        touch(path)
+        return value
+
+    def put(self, stage, key, value):
+        """Store ``value`` under ``key`` and evict old entries if over budget"""
+        with atomic_path(self._path(stage, key)) as tmp_path:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.evict()
+
+    def _entries(self):
+        return cache_entries([os.path.join(self.root, stage) for stage in STAGES], ".pkl")
+
+    def size(self):
+        """Total bytes currently used by cache entries"""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits ``max_bytes``"""
+        with self._lock:
+            evict_lru([os.path.join(self.root, stage) for stage in STAGES], ".pkl", self.max_bytes)
+
+    def clear(self):
+        """Remove every cached entry"""
+        with self._lock:
+            for _, _, path in self._entries():
+                remove_file(path)
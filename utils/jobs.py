@@ -0,0 +1,191 @@
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.ingest_cache import CACHE_DIR
+from utils.resources import resource
+
+JOB_DB = os.path.join(CACHE_DIR, "jobs.sqlite3")
+JOB_WORKERS = int(os.environ.get("STUDY_BUDDY_JOB_WORKERS", 4))
+# Job kinds that run on a pool of their own, so they never hold up the others.
+# Ingestions are serialized by the corpus' ingest lock anyway, so one thread is enough.
+DEDICATED_WORKERS = {"ingest": int(os.environ.get("STUDY_BUDDY_INGEST_WORKERS", 1))}
+# Finished jobs older than this are dropped from the table
+JOB_TTL = int(os.environ.get("STUDY_BUDDY_JOB_TTL", 7 * 24 * 3600))
+# Most recent results kept in memory, so pollers don't unpickle them again
+MAX_LIVE_RESULTS = 32
+# Progress is written to the table at most this often per job
+PROGRESS_INTERVAL = 0.5
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress TEXT,
+    result BLOB,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+
+
+class Job:
+    """Handle a running job function receives as its first argument"""
+
+    def __init__(self, queue, key):
+        self.queue = queue
+        self.key = key
+        self._written = 0.0
+
+    def report(self, **progress):
+        """Publish progress; pollers see it at once, the table at most every PROGRESS_INTERVAL"""
+        self.queue._progress[self.key] = progress
+        now = time.time()
+        if now - self._written >= PROGRESS_INTERVAL:
+            self._written = now
+            self.queue._update(self.key, progress=json.dumps(progress, default=str))
+
+
+class JobQueue:
+    """Thread pool with a persistent SQLite job table.
+
+    Jobs are keyed by a fingerprint of their inputs, which makes them
+    idempotent: submitting a key that is queued or running joins that job, and
+    submitting one that is done returns at once with its stored result unless
+    ``force`` is set. Work runs on pool threads, so it carries on through
+    Streamlit reruns; the UI polls :meth:`status` and fetches :meth:`result`.
+
+    The job function is called as ``func(job, *args, **kwargs)`` and can call
+    ``job.report(...)`` with JSON-serializable progress. Results are pickled
+    into the table, so they survive restarts; the most recent ones are also
+    kept in memory. Jobs a previous process left unfinished are marked failed
+    so they are run again when resubmitted. Kinds listed in ``dedicated``
+    run on their own pool of that many threads instead of the shared one.
+    """
+
+    def __init__(self, path=JOB_DB, max_workers=JOB_WORKERS, dedicated=DEDICATED_WORKERS):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(SCHEMA)
+        self._db_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="study-buddy-job")
+        self._executors = {
+            kind: ThreadPoolExecutor(workers, thread_name_prefix=f"study-buddy-{kind}")
+            for kind, workers in dedicated.items()
+        }
+        self._futures = {}
+        self._progress = {}
+        self._results = OrderedDict()
+        with self._db_lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE status IN (?, ?)",
+                (FAILED, "Interrupted by a restart", time.time(), QUEUED, RUNNING),
+            )
+        self.prune()
+
+    def _execute(self, sql, params=()):
+        with self._db_lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _update(self, key, **fields):
+        fields["updated"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self._execute(f"UPDATE jobs SET {columns} WHERE key = ?", (*fields.values(), key))
+
+    def submit(self, key, func, *args, kind="job", force=False, **kwargs):
+        """Run ``func`` for ``key`` unless the same job is running or already done"""
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None and not future.done():
+                return key
+            rows = self._execute("SELECT status FROM jobs WHERE key = ?", (key,))
+            if rows and rows[0][0] == DONE and not force and self._has_result(key):
+                return key
+            now = time.time()
+            self._execute(
+                "INSERT OR REPLACE INTO jobs (key, kind, status, progress, result, error, created, updated) "
+                "VALUES (?, ?, ?, NULL, NULL, NULL, ?, ?)",
+                (key, kind, QUEUED, now, now),
+            )
+            self._progress.pop(key, None)
+            self._results.pop(key, None)
+            job = Job(self, key)
+            executor = self._executors.get(kind, self._executor)
+            self._futures[key] = executor.submit(self._run, job, func, args, kwargs)
+        return key
+
+    def _run(self, job, func, args, kwargs):
+        key = job.key
+        try:
+            self._update(key, status=RUNNING)
+            try:
+                result = func(job, *args, **kwargs)
+            except Exception as e:
+                traceback.print_exc()
+                self._update(key, status=FAILED, error=f"{type(e).__name__}: {e}")
+                return
+            blob = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+            with self._lock:
+                self._results[key] = result
+                while len(self._results) > MAX_LIVE_RESULTS:
+                    self._results.popitem(last=False)
+            progress = self._progress.get(key)
+            self._update(key, status=DONE, result=blob, progress=json.dumps(progress, default=str) if progress else None)
+        finally:
+            # Finished jobs are answered from the table (and the in-memory results)
+            with self._lock:
+                for registry in (self._futures, self._progress):
+                    registry.pop(key, None)
+
+    def _has_result(self, key):
+        if key in self._results:
+            return True
+        rows = self._execute("SELECT result IS NOT NULL FROM jobs WHERE key = ?", (key,))
+        return bool(rows and rows[0][0])
+
+    def status(self, key):
+        """``{"status", "progress", "error", "kind", "updated"}`` for ``key``, or None if unknown"""
+        rows = self._execute("SELECT status, progress, error, kind, updated FROM jobs WHERE key = ?", (key,))
+        if not rows:
+            return None
+        status, progress, error, kind, updated = rows[0]
+        # Live progress is fresher than the throttled copy in the table
+        progress = self._progress.get(key) or (json.loads(progress) if progress else None)
+        return {"status": status, "progress": progress, "error": error, "kind": kind, "updated": updated}
+
+    def result(self, key):
+        """Return value of a finished job, or None"""
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+        rows = self._execute("SELECT result FROM jobs WHERE key = ? AND status = ?", (key, DONE))
+        if rows and rows[0][0] is not None:
+            return pickle.loads(rows[0][0])
+        return None
+
+    def prune(self, ttl=JOB_TTL):
+        """Drop finished jobs older than ``ttl`` seconds"""
+        self._execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?", (DONE, FAILED, time.time() - ttl))
+
+
+@resource
+def get_job_queue():
+    """Job queue shared by every session in the process"""
+    return JobQueue()
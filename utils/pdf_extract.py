@@ -0,0 +1,155 @@
+import io
+import mmap
+import multiprocessing
+import os
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # older installs only ship the PyPDF2 name
+    from PyPDF2 import PdfReader
+
+# Number of extraction processes; 1 runs everything in the calling process
+MAX_WORKERS = int(os.environ.get("STUDY_BUDDY_EXTRACT_WORKERS", os.cpu_count() or 1))
+# Large PDFs are split into tasks of this many pages so one book can use several cores
+PAGES_PER_TASK = int(os.environ.get("STUDY_BUDDY_PAGES_PER_TASK", 25))
+
+# Workers are not forked from the (multithreaded) Streamlit server, which can deadlock
+# on locks other threads held at the fork
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+_executor = None
+_executor_workers = None
+
+
+@contextmanager
+def _open(source):
+    """Open a PDF given as bytes, a file-like buffer or a file path.
+
+    Bytes and buffers are parsed in place (``BytesIO`` shares a bytes object
+    without copying it). Paths are memory-mapped rather than read into memory.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        yield PdfReader(io.BytesIO(source))
+    elif hasattr(source, "read"):
+        source.seek(0)
+        yield PdfReader(source)
+    else:
+        with open(source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield PdfReader(mapped)
+
+
+def count_pages(source):
+    """Number of pages in a PDF"""
+    with _open(source) as reader:
+        return len(reader.pages)
+
+
+def extract_page_range(source, start, stop):
+    """Extract the text of pages ``start`` to ``stop - 1``"""
+    with _open(source) as reader:
+        return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def _for_worker(source, spooled, split):
+    """Turn bytes or a buffer into something that can be sent to a worker process.
+
+    A PDF read by a single task is sent as bytes. One ``split`` into several
+    page ranges is written to a temp file whose path is recorded in
+    ``spooled`` so the caller can delete it, and only the path goes into each
+    task instead of a copy of the whole file per range.
+    """
+    if not isinstance(source, (bytes, bytearray, memoryview)) and not hasattr(source, "read"):
+        return source
+    if not split:
+        if not hasattr(source, "read"):
+            return bytes(source) if isinstance(source, memoryview) else source
+        if hasattr(source, "getvalue"):
+            return source.getvalue()
+        source.seek(0)
+        return source.read()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf", prefix="study-buddy-") as tmp_file:
+        spooled.append(tmp_file.name)
+        if not hasattr(source, "read"):
+            tmp_file.write(source)
+        elif hasattr(source, "getbuffer"):
+            tmp_file.write(source.getbuffer())
+        else:
+            source.seek(0)
+            tmp_file.write(source.read())
+    return tmp_file.name
+
+
+def get_executor(max_workers=None):
+    """Shared process pool, recreated only when the worker count changes"""
+    global _executor, _executor_workers
+    max_workers = max_workers or MAX_WORKERS
+    if _executor is None or _executor_workers != max_workers:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(START_METHOD))
+        _executor_workers = max_workers
+    return _executor
+
+
+def _plan_tasks(sources, pages_per_task):
+    tasks = []
+    for n, source in enumerate(sources):
+        num_pages = count_pages(source)
+        for start in range(0, num_pages, pages_per_task):
+            tasks.append((n, source, start, min(start + pages_per_task, num_pages)))
+    return tasks
+
+
+def iter_texts(sources, max_workers=None, pages_per_task=PAGES_PER_TASK):
+    """Yield ``(source_index, first_page, page_texts)`` for each page range, in order.
+
+    ``sources`` are PDF bytes, file-like buffers (such as Streamlit uploads) or
+    file paths. Every range is submitted to the process pool up front, so
+    extraction of later files overlaps with the caller consuming earlier ones.
+    Ranges are yielded in file and page order however the work was scheduled,
+    and closing the generator cancels ranges that have not started yet and
+    removes any spool files.
+    """
+    max_workers = max_workers or MAX_WORKERS
+    tasks = _plan_tasks(sources, pages_per_task)
+
+    if max_workers <= 1 or len(tasks) <= 1:
+        for n, source, start, stop in tasks:
+            yield n, start, extract_page_range(source, start, stop)
+        return
+
+    executor = get_executor(max_workers)
+    spooled = []
+    futures = []
+    try:
+        task_counts = Counter(n for n, _, _, _ in tasks)
+        worker_sources = [_for_worker(source, spooled, task_counts[n] > 1) for n, source in enumerate(sources)]
+        futures = [executor.submit(extract_page_range, worker_sources[n], start, stop) for n, _, start, stop in tasks]
+        for (n, _, start, _), future in zip(tasks, futures):
+            yield n, start, future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        for path in spooled:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def extract_texts(sources, max_workers=None, pages_per_task=PAGES_PER_TASK):
+    """Extract page texts from several PDFs in parallel.
+
+    ``sources`` are PDF bytes, buffers or file paths. Each file is split into page
+    ranges of ``pages_per_task`` pages and the ranges are spread over a process
+    pool. Returns one list of page texts per source, in the same order as
+    ``sources`` and in page order, however the work was scheduled.
+    """
+    texts = [[] for _ in sources]
+    for n, _, pages in iter_texts(sources, max_workers, pages_per_task):
+        texts[n].extend(pages)
+    return texts
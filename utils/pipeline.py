@@ -0,0 +1,141 @@
+import os
+
+from langchain_core.documents import Document
+
+from utils.ingest_cache import embedding_settings, make_key
+from utils.pdf_extract import iter_texts
+
+# Chunks in the first embedding batch of a file; later batches double in size up
+# to EMBED_MAX_BATCH_SIZE so the embedding client has enough work to parallelise
+EMBED_BATCH_SIZE = int(os.environ.get("STUDY_BUDDY_EMBED_BATCH_SIZE", 64))
+EMBED_MAX_BATCH_SIZE = int(os.environ.get("STUDY_BUDDY_EMBED_MAX_BATCH_SIZE", 1024))
+
+
+def _batched(items, size, max_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+            size = min(size * 2, max_size)
+    if batch:
+        yield batch
+
+
+def stream_ingest(manager, uploads, cache, splitter, splitter_settings, batch_size=EMBED_BATCH_SIZE,
+                  max_batch_size=EMBED_MAX_BATCH_SIZE, prune=True):
+    """Bring ``manager`` in line with ``uploads`` one embedding batch at a time.
+
+    ``uploads`` maps file hash to ``(name, pdf)`` where ``pdf`` is anything
+    ``iter_texts`` accepts (bytes, a file-like buffer or a path). Pages are
+    extracted in the background process pool, split as they arrive, embedded in
+    batches (``batch_size`` chunks at first, doubling up to ``max_batch_size``)
+    and appended to the index straight away, so the index is searchable after
+    the first batch. A progress dict is yielded after every
+    batch and after every file; the last one has ``done=True``.
+
+    Stages already in ``cache`` are reused, and every finished file is written
+    back to the cache. The generator can be paused between batches (e.g. by a
+    Streamlit rerun) and resumed later.
+
+    With ``prune=False`` files other than ``uploads`` are kept (for an index
+    shared by several sessions); half-indexed files are still removed, so the
+    caller must make sure no other ingestion into ``manager`` is running.
+    """
+    embeddings = manager.embeddings
+    removed = manager.prune(list(uploads) if prune else list(manager.files))
+    new = [h for h in uploads if h not in manager.files]
+    progress = {"file": None, "files_done": 0, "files_total": len(new), "chunks": 0, "done": False}
+
+    def chunks_key(file_hash):
+        return make_key(file_hash, splitter_settings)
+
+    def vectors_key(file_hash):
+        return make_key(file_hash, splitter_settings, embedding_settings(embeddings))
+
+    # Work out which stages each new file still needs
+    cached_chunks = {}
+    cached_pages = {}
+    to_extract = []
+    for file_hash in new:
+        chunks = cache.get("chunks", chunks_key(file_hash))
+        if chunks is not None:
+            cached_chunks[file_hash] = chunks
+            continue
+        pages = cache.get("pages", make_key(file_hash))
+        if pages is not None:
+            cached_pages[file_hash] = pages
+        else:
+            to_extract.append(file_hash)
+
+    # One page stream covers every file that needs extracting, in upload order
+    ranges = iter_texts([uploads[h][1] for h in to_extract])
+    next_range = [next(ranges, None)]
+
+    def extracted_pages(n, name):
+        while next_range[0] is not None and next_range[0][0] == n:
+            _, start, texts = next_range[0]
+            for offset, text in enumerate(texts):
+                yield Document(page_content=text, metadata={"source": name, "page": start + offset})
+            next_range[0] = next(ranges, None)
+
+    try:
+        for file_hash in new:
+            name = uploads[file_hash][0]
+            progress["file"] = name
+
+            chunks = cached_chunks.get(file_hash)
+            vectors = cache.get("vectors", vectors_key(file_hash)) if chunks is not None else None
+            if vectors is not None:
+                manager.add_file(file_hash, chunks, vectors)
+                progress["chunks"] += len(chunks)
+                progress["files_done"] += 1
+                yield dict(progress)
+                continue
+
+            pages = []
+            if chunks is not None:
+                chunk_stream = iter(chunks)
+            else:
+                if file_hash in cached_pages:
+                    page_stream = iter(cached_pages[file_hash])
+                else:
+                    page_stream = extracted_pages(to_extract.index(file_hash), name)
+
+                def recorded(page_stream=page_stream):
+                    for page in page_stream:
+                        pages.append(page)
+                        yield page
+
+                if hasattr(splitter, "iter_split"):
+                    # Streaming chunkers see the pages in order and may carry text across pages
+                    chunk_stream = splitter.iter_split(recorded())
+                else:
+                    chunk_stream = (chunk for page in recorded() for chunk in splitter.split_documents([page]))
+
+            all_chunks = []
+            all_vectors = []
+            manager.append(file_hash, [], [])
+            for batch in _batched(chunk_stream, batch_size, max_batch_size):
+                batch_vectors = embeddings.embed_documents([chunk.page_content for chunk in batch])
+                manager.append(file_hash, batch, batch_vectors)
+                all_chunks.extend(batch)
+                all_vectors.extend(batch_vectors)
+                progress["chunks"] += len(batch)
+                yield dict(progress)
+            manager.finish_file(file_hash)
+
+            if file_hash not in cached_pages and chunks is None:
+                cache.put("pages", make_key(file_hash), pages)
+            cache.put("chunks", chunks_key(file_hash), all_chunks)
+            cache.put("vectors", vectors_key(file_hash), all_vectors)
+            progress["files_done"] += 1
+            yield dict(progress)
+    finally:
+        # Stops pending extraction and removes spool files if ingestion is abandoned
+        ranges.close()
+
+    progress["done"] = True
+    progress["changed"] = bool(new or removed)
+    yield dict(progress)
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from utils.resources import get_cross_encoder, resource
+
+# Off by default: the cross-encoder costs CPU time per candidate
+RERANK_ENABLED = os.environ.get("STUDY_BUDDY_RERANK", "0").lower() in ("1", "true", "yes")
+RERANK_MODEL = os.environ.get("STUDY_BUDDY_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_BATCH_SIZE = int(os.environ.get("STUDY_BUDDY_RERANK_BATCH_SIZE", 32))
+# (query, chunk) scores remembered before the least recently used are dropped
+RERANK_CACHE_SIZE = int(os.environ.get("STUDY_BUDDY_RERANK_CACHE_SIZE", 50000))
+
+
+def _pair_key(query, text):
+    return hashlib.blake2b(f"{query}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+
+class CrossEncoderReranker:
+    """Scores (query, chunk) pairs with a local cross-encoder, memoizing every score.
+
+    Pairs not seen before are scored in batches of ``batch_size`` in one
+    ``predict`` call; repeated questions (and chunks that come back for
+    follow-ups) are served from an LRU memo keyed by a hash of the pair.
+    """
+
+    def __init__(self, model=RERANK_MODEL, batch_size=RERANK_BATCH_SIZE, cache_size=RERANK_CACHE_SIZE):
+        self.model = model
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+
+    def score_pairs(self, pairs):
+        """Relevance score of each ``(query, text)`` pair, higher is more relevant"""
+        keys = [_pair_key(query, text) for query, text in pairs]
+        scores = [None] * len(pairs)
+        missing = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[i] = self._scores[key]
+                else:
+                    missing.setdefault(key, i)
+        if missing:
+            model = get_cross_encoder(self.model)
+            fresh = model.predict([pairs[i] for i in missing.values()], batch_size=self.batch_size, show_progress_bar=False)
+            with self._lock:
+                for key, score in zip(missing, fresh):
+                    self._scores[key] = float(score)
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+            fresh = dict(zip(missing, fresh))
+            scores = [float(fresh[key]) if score is None else score for key, score in zip(keys, scores)]
+        return scores
+
+    def rerank(self, query, texts, top_n):
+        """Indices of the ``top_n`` best ``texts`` for ``query``, best first"""
+        scores = self.score_pairs([(query, text) for text in texts])
+        return sorted(range(len(texts)), key=lambda i: scores[i], reverse=True)[:top_n]
+
+
+@resource
+def get_reranker(model=RERANK_MODEL):
+    """Re-ranker (and its score memo) shared by every session"""
+    return CrossEncoderReranker(model)
+
+
+class RerankingRetriever(BaseRetriever):
+    """Re-orders a retriever's candidates with a cross-encoder and keeps the best ``top_n``"""
+
+    retriever: BaseRetriever
+    reranker: Any
+    top_n: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        documents = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        if not documents:
+            return []
+        best = self.reranker.rerank(query, [doc.page_content for doc in documents], self.top_n)
+        return [documents[i] for i in best]
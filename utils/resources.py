@@ -0,0 +1,114 @@
+import functools
+import threading
+
+import httpx
+
+# Shared connection pool limits for calls to the OpenAI API
+HTTP_MAX_CONNECTIONS = 20
+HTTP_MAX_KEEPALIVE = 10
+HTTP_TIMEOUT = 120
+
+
+def _streamlit_cache():
+    """``st.cache_resource`` when running inside a Streamlit app, else None"""
+    try:
+        import streamlit as st
+        from streamlit import runtime
+    except ImportError:
+        return None
+    if not runtime.exists():
+        return None
+    return st.cache_resource(show_spinner=False)
+
+
+def resource(func):
+    """Create ``func``'s result once per distinct arguments and share it process-wide.
+
+    Inside a Streamlit app this is ``st.cache_resource``, so the objects are
+    reused across reruns and sessions and cleared by "Clear cache". Elsewhere
+    (e.g. the sentence-transformers script) a locked dictionary does the same.
+    """
+    streamlit_cache = _streamlit_cache()
+    if streamlit_cache is not None:
+        return streamlit_cache(func)
+
+    cache = {}
+    lock = threading.Lock()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        with lock:
+            if key not in cache:
+                cache[key] = func(*args, **kwargs)
+            return cache[key]
+
+    wrapper.clear = cache.clear
+    return wrapper
+
+
+@resource
+def get_http_client():
+    """Pooled HTTP client reused by every OpenAI chat client"""
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+        timeout=HTTP_TIMEOUT,
+    )
+
+
+@resource
+def get_openai_client():
+    """OpenAI API client on the shared connection pool"""
+    import openai
+    return openai.OpenAI(http_client=get_http_client())
+
+
+@resource
+def get_chat_model(model="gpt-4o", temperature=0.3, streaming=False):
+    """Shared ChatOpenAI client for ``model`` at ``temperature``.
+
+    With ``streaming`` the response is read token by token and each token is
+    passed to the ``on_llm_new_token`` callbacks of the call.
+    """
+    from langchain_community.chat_models import ChatOpenAI
+    return ChatOpenAI(model=model, temperature=temperature, streaming=streaming, client=get_openai_client().chat.completions)
+
+
+@resource
+def get_sentence_transformer(name="all-MiniLM-L6-v2", device="cpu", runtime="torch", int8=False):
+    """Load a sentence-transformers model once per process.
+
+    ``runtime`` is "torch", "onnx" or "openvino". ``int8`` applies dynamic int8
+    quantization (torch) or picks the pre-quantized ONNX weights (onnx).
+    """
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError as e:
+        raise ImportError(
+            "The local embedding backend requires sentence-transformers. "
+            "Install with: pip install sentence-transformers"
+        ) from e
+
+    if runtime == "torch":
+        model = SentenceTransformer(name, device=device)
+        if int8:
+            import torch
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return model
+    model_kwargs = {}
+    if int8 and runtime == "onnx":
+        model_kwargs["file_name"] = "onnx/model_qint8_avx512_vnni.onnx"
+    return SentenceTransformer(name, device=device, backend=runtime, model_kwargs=model_kwargs)
+
+
+@resource
+def get_cross_encoder(name="cross-encoder/ms-marco-MiniLM-L-6-v2", device="cpu"):
+    """Load a sentence-transformers cross-encoder once per process"""
+    try:
+        from sentence_transformers import CrossEncoder
+    except ImportError as e:
+        raise ImportError(
+            "Re-ranking requires sentence-transformers. "
+            "Install with: pip install sentence-transformers"
+        ) from e
+    return CrossEncoder(name, device=device)
@@ -0,0 +1,141 @@
+import os
+import re
+import threading
+
+import faiss
+import numpy as np
+
+# Cosine similarity above which an earlier question counts as the same question
+SIMILARITY_THRESHOLD = 0.95
+# ada-002 scores even unrelated questions around 0.7-0.8 and questions a word apart above 0.95
+MODEL_THRESHOLDS = {"text-embedding-ada-002": 0.98}
+# Overrides the per-model thresholds (see ``python -m utils.semantic_cache`` to pick one)
+THRESHOLD_OVERRIDE = os.environ.get("STUDY_BUDDY_ANSWER_CACHE_THRESHOLD")
+# Nearest earlier questions checked per lookup
+LOOKUP_CANDIDATES = 4
+# Questions remembered per document set before the oldest are forgotten
+MAX_ENTRIES = int(os.environ.get("STUDY_BUDDY_ANSWER_CACHE_ENTRIES", 2000))
+
+
+NUMBER_RE = re.compile(r"\d+(?:\.\d+)*")
+
+
+def similarity_threshold(model=None):
+    """Cosine threshold for question vectors from the embedding ``model``"""
+    if THRESHOLD_OVERRIDE:
+        return float(THRESHOLD_OVERRIDE)
+    return MODEL_THRESHOLDS.get(model, SIMILARITY_THRESHOLD)
+
+
+def _numbers(question):
+    """Numbers in a question; "chapter 1" and "chapter 2" embed almost alike but are different questions"""
+    return sorted(NUMBER_RE.findall(question)) if question is not None else None
+
+
+class _Bucket:
+    """Question vectors, numbers and answers for one document set"""
+
+    def __init__(self, dimension):
+        self.index = faiss.IndexFlatIP(dimension)
+        self.vectors = []
+        self.numbers = []
+        self.answers = []
+
+
+class SemanticCache:
+    """Answer cache looked up by embedding similarity of the standalone question.
+
+    Questions are grouped by a fingerprint of the document set they were asked
+    about. Each group keeps a small inner-product FAISS index over unit-length
+    question vectors, so a lookup returns the answer to the most similar earlier
+    question when its cosine similarity is at least ``threshold`` (by default
+    :func:`similarity_threshold` of the embedding model) and, when the question
+    text is given, it mentions the same numbers. The cache is thread-safe and
+    meant to be shared by every session in the process.
+    """
+
+    def __init__(self, threshold=None, max_entries=MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype="float32").reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def lookup(self, fingerprint, vector, question=None, model=None):
+        """Return the cached answer for a question vector, or None on a miss"""
+        query = self._normalize(vector)
+        threshold = self.threshold if self.threshold is not None else similarity_threshold(model)
+        numbers = _numbers(question)
+        with self._lock:
+            bucket = self._buckets.get(fingerprint)
+            if bucket is not None and bucket.index.ntotal and bucket.index.d == query.shape[1]:
+                scores, ids = bucket.index.search(query, min(LOOKUP_CANDIDATES, bucket.index.ntotal))
+                for score, i in zip(scores[0], ids[0]):
+                    if i < 0 or score < threshold:
+                        break
+                    if numbers is None or bucket.numbers[i] is None or bucket.numbers[i] == numbers:
+                        self.hits += 1
+                        return bucket.answers[i]
+            self.misses += 1
+            return None
+
+    def store(self, fingerprint, vector, answer, question=None):
+        """Remember ``answer`` for a question vector (and its text, to compare numbers)"""
+        query = self._normalize(vector)
+        with self._lock:
+            bucket = self._buckets.get(fingerprint)
+            if bucket is None or bucket.index.d != query.shape[1]:
+                bucket = self._buckets[fingerprint] = _Bucket(query.shape[1])
+            if len(bucket.answers) >= self.max_entries:
+                # Forget the oldest half and rebuild the (small) index
+                keep = max(self.max_entries // 2, 1)
+                bucket.vectors = bucket.vectors[-keep:]
+                bucket.numbers = bucket.numbers[-keep:]
+                bucket.answers = bucket.answers[-keep:]
+                bucket.index.reset()
+                bucket.index.add(np.vstack(bucket.vectors))
+            bucket.vectors.append(query)
+            bucket.numbers.append(_numbers(question))
+            bucket.answers.append(answer)
+            bucket.index.add(query)
+
+    def stats(self):
+        """Hit and miss counters since the process started"""
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    from utils.embedding_backends import get_embeddings
+
+    parser = argparse.ArgumentParser(description="Pick an answer cache threshold from labelled question pairs")
+    parser.add_argument("pairs", help='JSONL of {"a": question, "b": question, "same": true/false}')
+    parser.add_argument("--backend", default="openai", help='"openai" or "local"')
+    args = parser.parse_args()
+    with open(args.pairs, encoding="utf-8") as f:
+        pairs = [json.loads(line) for line in f if line.strip()]
+    embeddings = get_embeddings(args.backend)
+    a = np.asarray(embeddings.embed_documents([p["a"] for p in pairs]), dtype="float32")
+    b = np.asarray(embeddings.embed_documents([p["b"] for p in pairs]), dtype="float32")
+    faiss.normalize_L2(a)
+    faiss.normalize_L2(b)
+    scores = (a * b).sum(axis=1)
+    same = np.asarray([bool(p["same"]) for p in pairs])
+    guarded = np.asarray([_numbers(p["a"]) == _numbers(p["b"]) for p in pairs])
+    for score, pair in sorted(zip(scores, pairs), key=lambda item: -item[0]):
+        print(f"{score:.4f}  {'same' if pair['same'] else 'diff'}  {pair['a']!r} / {pair['b']!r}")
+    # Lowest threshold at which no different-question pair that passes the number check is matched
+    wrong = scores[~same & guarded]
+    threshold = float(np.nextafter(wrong.max(), 1)) if len(wrong) else float(scores[same].min())
+    print(f"model {getattr(embeddings, 'model', None)}: current threshold {similarity_threshold(embeddings.model):.3f}, "
+          f"safe threshold {threshold:.4f} matches {(scores[same] >= threshold).mean():.0%} of the same-question pairs")
@@ -0,0 +1,106 @@
+import asyncio
+import queue
+import threading
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from utils.resources import resource
+
+_DONE = object()
+
+
+class StreamCancelled(Exception):
+    """Raised inside the LLM call when its TokenStream is cancelled"""
+
+
+class _TokenHandler(BaseCallbackHandler):
+    # Let StreamCancelled propagate so the LLM stops reading the response
+    raise_error = True
+
+    def __init__(self, tokens, cancelled):
+        self.tokens = tokens
+        self.cancelled = cancelled
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.cancelled.is_set():
+            raise StreamCancelled()
+        if token:
+            self.tokens.put(token)
+
+
+class TokenStream:
+    """Run a LangChain call in a background thread and iterate over its tokens as they arrive.
+
+    ``run(callbacks)`` must make the call with ``callbacks`` attached (and a
+    streaming LLM) and return its final value, which is available as
+    ``result`` once iteration ends. Iterating is what starts the call, so the
+    stream can be handed straight to ``st.write_stream``. Calling
+    :meth:`cancel`, or abandoning the iteration (e.g. when Streamlit stops the
+    script for a new question), aborts the LLM call at its next token; a
+    stream cancelled while still being read raises StreamCancelled.
+    """
+
+    def __init__(self, run):
+        self._run = run
+        self._tokens = queue.Queue()
+        self._cancelled = threading.Event()
+        self.result = None
+        self.error = None
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def _work(self):
+        try:
+            self.result = self._run([_TokenHandler(self._tokens, self._cancelled)])
+        except Exception as e:
+            self.error = e
+        finally:
+            self._tokens.put(_DONE)
+
+    def __iter__(self):
+        threading.Thread(target=self._work, daemon=True).start()
+        try:
+            while True:
+                token = self._tokens.get()
+                if token is _DONE:
+                    break
+                yield token
+        finally:
+            self.cancel()
+        if self.error is not None:
+            raise self.error
+
+
+@resource
+def get_event_loop():
+    """Event loop running on a daemon thread, shared by every session.
+
+    Async clients (e.g. the one inside a shared ChatOpenAI) hold connections
+    bound to the loop they were first used on, so all async work runs here.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="study-buddy-event-loop", daemon=True).start()
+    return loop
+
+
+def iter_async(async_iterator):
+    """Iterate an async generator from synchronous code, item by item.
+
+    The generator runs on :func:`get_event_loop`. If the caller stops early
+    (including when Streamlit stops the script) the generator is closed, so
+    its ``finally`` blocks can cancel outstanding work.
+    """
+    loop = get_event_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(async_iterator.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        asyncio.run_coroutine_threadsafe(async_iterator.aclose(), loop)
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from utils.ingest_cache import CACHE_DIR, atomic_path, evict_lru, remove_file, touch
+
+STUDIO_CACHE_DIR = os.path.join(CACHE_DIR, "studio")
+# Generated outputs expire after a week and the cache is capped at 50 MB
+STUDIO_CACHE_TTL = int(os.environ.get("STUDY_BUDDY_STUDIO_CACHE_TTL", 7 * 24 * 3600))
+STUDIO_CACHE_MAX_BYTES = int(os.environ.get("STUDY_BUDDY_STUDIO_CACHE_MAX_BYTES", 50 * 1024 ** 2))
+
+
+def documents_fingerprint(documents):
+    """Hash of the text and source metadata of a list of LangChain documents"""
+    digest = hashlib.sha256()
+    for doc in documents:
+        digest.update(doc.page_content.encode("utf-8"))
+        digest.update(json.dumps(doc.metadata, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class StudioCache:
+    """Persistent cache of Studio generator outputs with TTL and size-bounded eviction.
+
+    Each entry is a small JSON file holding the result and when it was made.
+    Entries older than ``ttl`` seconds are treated as misses and deleted, and
+    once the directory exceeds ``max_bytes`` the least recently read entries
+    are evicted first.
+    """
+
+    def __init__(self, root=STUDIO_CACHE_DIR, ttl=STUDIO_CACHE_TTL, max_bytes=STUDIO_CACHE_MAX_BYTES):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key + ".json")
+
+    def get(self, key):
+        """Return the cached result for ``key`` or None if missing or expired"""
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            remove_file(path)
+            return None
+        if time.time() - entry["created"] > self.ttl:
+            remove_file(path)
+            return None
+        touch(path)
+        return entry["result"]
+
+    def put(self, key, result):
+        """Store ``result`` under ``key`` and evict entries if over budget"""
+        with atomic_path(self._path(key)) as tmp_path:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"created": time.time(), "result": result}, f)
+        self.evict()
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones until under ``max_bytes``"""
+        with self._lock:
+            # mtime is at least the creation time, so this only drops entries that are surely expired
+            evict_lru([self.root], ".json", self.max_bytes, ttl=self.ttl)
@@ -0,0 +1,115 @@
+import os
+from itertools import groupby
+
+from utils.context_packer import remove_overlaps
+from utils.ingest_cache import CACHE_DIR, make_key
+from utils.studio_cache import StudioCache
+from utils.tokens import count_tokens, truncate_tokens
+
+SUMMARY_CACHE_DIR = os.path.join(CACHE_DIR, "summaries")
+# Tokens of source text sent in one map/reduce request
+GROUP_TOKENS = int(os.environ.get("STUDY_BUDDY_SUMMARY_GROUP_TOKENS", 6000))
+# Map/reduce requests in flight at once
+SUMMARY_CONCURRENCY = int(os.environ.get("STUDY_BUDDY_SUMMARY_CONCURRENCY", 8))
+
+# Bump when the prompts below change so cached summaries are not reused
+SUMMARY_PROMPT_VERSION = 1
+
+MAP_PROMPT = """
+Summarize the following excerpt from a study document.
+Keep the key concepts, definitions, facts, formulas, examples and section headings.
+Be concise but do not drop topics.
+
+Excerpt:
+{text}
+"""
+
+REDUCE_PROMPT = """
+Combine the following partial summaries of one study document into a single summary.
+Keep every distinct topic, key concept and important detail, in the order they appear.
+Remove repetition.
+
+Partial summaries:
+{text}
+"""
+
+
+def group_texts(texts, max_tokens, model=None):
+    """Join consecutive texts into groups of at most ``max_tokens`` tokens"""
+    groups = []
+    group = []
+    group_tokens = 0
+    for text in texts:
+        tokens = count_tokens(text, model)
+        if group and group_tokens + tokens > max_tokens:
+            groups.append("\n\n".join(group))
+            group = []
+            group_tokens = 0
+        group.append(text)
+        group_tokens += tokens
+    if group:
+        groups.append("\n\n".join(group))
+    return groups
+
+
+def _summarize_all(llm, template, texts, cache, concurrency):
+    """Run ``template`` over every text concurrently, reusing cached summaries"""
+    model = getattr(llm, "model_name", type(llm).__name__)
+    keys = [make_key(text, template, model, SUMMARY_PROMPT_VERSION) for text in texts]
+    done = {}
+    for key in keys:
+        if key not in done:
+            done[key] = cache.get(key)
+    # Identical texts (e.g. repeated boilerplate pages) are only summarized once
+    todo = {key: text for key, text in zip(keys, texts) if done[key] is None}
+    if todo:
+        responses = llm.batch(
+            [template.format(text=text) for text in todo.values()],
+            config={"max_concurrency": concurrency},
+            return_exceptions=True,
+        )
+        for (key, text), response in zip(todo.items(), responses):
+            if isinstance(response, Exception):
+                # Fall back to the start of the text rather than losing the section
+                done[key] = truncate_tokens(text, GROUP_TOKENS // 8)
+            else:
+                done[key] = response.content
+                cache.put(key, done[key])
+    return [done[key] for key in keys]
+
+
+def summarize_corpus(documents, llm, target_tokens, cache=None, group_tokens=GROUP_TOKENS,
+                     concurrency=SUMMARY_CONCURRENCY, max_overlap=0):
+    """Condense a whole document set to at most ``target_tokens`` tokens.
+
+    Text that already fits is returned unchanged. Otherwise each source
+    file's chunks are packed into groups of ``group_tokens``, each group is
+    summarized (map), and the summaries are repeatedly grouped and summarized
+    again (reduce) until the result fits. Requests within a level run
+    concurrently, and every summary is cached by the hash of its input.
+    Groups never span two files, so a file's map summaries are reused by
+    every document set that includes it, whatever else is added or removed.
+    ``max_overlap`` is the splitter's chunk overlap; that much repeated text
+    between neighbouring chunks is dropped first.
+    """
+    if max_overlap:
+        documents = remove_overlaps(documents, max_overlap)
+    files = [[doc.page_content for doc in docs if doc.page_content.strip()]
+             for _, docs in groupby(documents, key=lambda doc: doc.metadata.get("source"))]
+    joined = "\n\n".join(text for texts in files for text in texts)
+    if count_tokens(joined) <= target_tokens:
+        return joined
+
+    cache = cache or StudioCache(SUMMARY_CACHE_DIR)
+    groups = [group for texts in files for group in group_texts(texts, group_tokens)]
+    summaries = _summarize_all(llm, MAP_PROMPT, groups, cache, concurrency)
+    while True:
+        joined = "\n\n".join(summaries)
+        if count_tokens(joined) <= target_tokens or len(summaries) == 1:
+            break
+        groups = group_texts(summaries, group_tokens)
+        if len(groups) == len(summaries):
+            # Summaries are too long to pair up, so another level would not shrink anything
+            break
+        summaries = _summarize_all(llm, REDUCE_PROMPT, groups, cache, concurrency)
+    return truncate_tokens(joined, target_tokens)
@@ -0,0 +1,45 @@
+from functools import lru_cache
+
+import tiktoken
+
+# Encoding used by the OpenAI chat and embedding models the apps call
+DEFAULT_ENCODING = "cl100k_base"
+# Rough characters per token, used when tiktoken's encoding files can't be loaded
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model=None):
+    """Tiktoken encoder for ``model``, loaded once per process.
+
+    Returns None when the encoding can't be loaded (tiktoken downloads its
+    files on first use, which fails offline).
+    """
+    try:
+        if model:
+            try:
+                return tiktoken.encoding_for_model(model)
+            except KeyError:
+                pass
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception:
+        return None
+
+
+def count_tokens(text, model=None):
+    """Number of tokens ``text`` takes up for ``model``"""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens, model=None):
+    """Cut ``text`` down to at most ``max_tokens`` tokens"""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
@@ -0,0 +1,175 @@
+import importlib.util
+import os
+import threading
+import wave
+
+from utils.chunker import split_sentences
+from utils.ingest_cache import CACHE_DIR, atomic_path, evict_lru, make_key, remove_file, touch
+from utils.jobs import get_job_queue
+from utils.resources import resource
+
+TTS_CACHE_DIR = os.path.join(CACHE_DIR, "tts")
+TTS_CACHE_MAX_BYTES = int(os.environ.get("STUDY_BUDDY_TTS_CACHE_MAX_BYTES", 500 * 1024 ** 2))
+# Words per minute and volume the Audio Overview has always used
+TTS_RATE = 150
+TTS_VOLUME = 0.9
+# Narrations are rendered in segments of about this many characters, cut between sentences
+TTS_SEGMENT_CHARS = int(os.environ.get("STUDY_BUDDY_TTS_SEGMENT_CHARS", 1200))
+TTS_AVAILABLE = importlib.util.find_spec("pyttsx3") is not None
+
+# Studio languages to the codes TTS engines tag their voices with
+LANGUAGE_CODES = {
+    "English": "en", "Hindi": "hi", "Bengali": "bn", "Gujarati": "gu", "Kannada": "kn",
+    "Malayalam": "ml", "Marathi": "mr", "Punjabi": "pa", "Tamil": "ta", "Telugu": "te",
+}
+
+
+def segment_text(text, max_chars=TTS_SEGMENT_CHARS):
+    """Split a narration into segments of whole sentences, each at most about ``max_chars``"""
+    segments = []
+    current = []
+    size = 0
+    for paragraph in text.split("\n"):
+        for sentence in split_sentences(paragraph):
+            if current and size + len(sentence) > max_chars:
+                segments.append(" ".join(current))
+                current, size = [], 0
+            current.append(sentence.strip())
+            size += len(sentence) + 1
+    if current:
+        segments.append(" ".join(current))
+    return segments
+
+
+def _voice_language_codes(voice):
+    codes = []
+    for language in getattr(voice, "languages", None) or []:
+        if isinstance(language, bytes):
+            # espeak prefixes the code with a priority byte
+            language = language[1:].decode("ascii", "ignore")
+        codes.append(str(language).lower().replace("_", "-"))
+    return codes
+
+
+class TTSService:
+    """Renders narrations to WAV files off the script thread and caches them by content.
+
+    Audio is stored under a hash of the text, voice, rate and language, so a
+    narration is synthesized once and then served from disk to every session;
+    names never collide, so sessions don't overwrite each other's audio. Long
+    narrations are rendered segment by segment in a background job (see
+    ``utils.jobs``), each segment cached on its own, so the first part can be
+    played while the rest is still being rendered; the segments are then
+    joined into one file and removed. pyttsx3 engines are not thread-safe, so
+    synthesis is serialized.
+    """
+
+    def __init__(self, root=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._engine_lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def settings(voice=None, rate=TTS_RATE, language="English"):
+        return {"voice": voice, "rate": rate, "volume": TTS_VOLUME, "language": language}
+
+    def _path(self, key):
+        return os.path.join(self.root, key + ".wav")
+
+    def key(self, text, voice=None, rate=TTS_RATE, language="English"):
+        """Cache key of a whole narration"""
+        return make_key(text, self.settings(voice, rate, language))
+
+    def cached(self, text, voice=None, rate=TTS_RATE, language="English"):
+        """Path of the rendered narration, or None if it hasn't been rendered yet"""
+        path = self._path(self.key(text, voice, rate, language))
+        if not os.path.exists(path):
+            return None
+        touch(path)
+        return path
+
+    def submit(self, text, voice=None, rate=TTS_RATE, language="English"):
+        """Render a narration in a background job (joining one already running); returns the job key"""
+        settings = self.settings(voice, rate, language)
+        key = self.key(text, voice, rate, language)
+        # Only called on a cache miss, so a finished job's file has been evicted and must be rendered again
+        return get_job_queue().submit(make_key("tts", key), self._render, text, settings, key, kind="tts", force=True)
+
+    def _render(self, job, text, settings, key):
+        parts = segment_text(text)
+        if not parts:
+            raise ValueError("Nothing to narrate")
+        if len(parts) == 1:
+            path = self._render_segment(parts[0], settings, self._path(key))
+            job.report(segments=[path], total=1)
+            return path
+        segments = []
+        for part in parts:
+            segments.append(self._render_segment(part, settings))
+            job.report(segments=segments, total=len(parts))
+        return self._join(segments, self._path(key))
+
+    def _render_segment(self, text, settings, path=None):
+        path = path or self._path(make_key(text, settings))
+        if os.path.exists(path):
+            return path
+        # Engines pick the audio format from the extension
+        with atomic_path(path, suffix=".tmp.wav") as tmp_path:
+            with self._engine_lock:
+                engine = self._engine(settings)
+                engine.save_to_file(text, tmp_path)
+                engine.runAndWait()
+        self.evict()
+        return path
+
+    def _engine(self, settings):
+        try:
+            import pyttsx3
+        except ImportError as e:
+            raise ImportError("Audio playback requires pyttsx3. Install with: pip install pyttsx3") from e
+        engine = pyttsx3.init()
+        engine.setProperty("rate", settings["rate"])
+        engine.setProperty("volume", settings["volume"])
+        voice = settings["voice"] or self._voice_for(engine, settings["language"])
+        if voice:
+            engine.setProperty("voice", voice)
+        return engine
+
+    @staticmethod
+    def _voice_for(engine, language):
+        """Id of an installed voice for ``language``, or None to keep the default"""
+        code = LANGUAGE_CODES.get(language)
+        if code is None or code == "en":
+            return None
+        for voice in engine.getProperty("voices"):
+            codes = _voice_language_codes(voice)
+            if any(c == code or c.startswith(code + "-") for c in codes) or language.lower() in voice.name.lower():
+                return voice.id
+        return None
+
+    def _join(self, segments, path):
+        """Concatenate segment WAVs into ``path`` and delete the segments"""
+        with atomic_path(path, suffix=".tmp.wav") as tmp_path:
+            with wave.open(tmp_path, "wb") as out:
+                for i, segment in enumerate(segments):
+                    with wave.open(segment, "rb") as part:
+                        if i == 0:
+                            out.setparams(part.getparams())
+                        out.writeframes(part.readframes(part.getnframes()))
+        for segment in segments:
+            remove_file(segment)
+        self.evict()
+        return path
+
+    def evict(self):
+        """Drop the least recently played audio until the cache is under ``max_bytes``"""
+        with self._evict_lock:
+            evict_lru([self.root], ".wav", self.max_bytes)
+
+
+@resource
+def get_tts():
+    """TTS service shared by every session in the process"""
+    return TTSService()